@@ -0,0 +1,195 @@
+/*
+ * Browser version of the simulation and figure callbacks in compounding.py, used when the app runs with
+ * CPD_CLIENTSIDE=1. simulate() follows cpd_interest_loop in simulation.py step for step (same float ops in the
+ * same order) so the Amount series is identical. The figures start from a skeleton built by create_cpd_fig_v2 /
+ * plot_merged_bar in python and only the data arrays are filled in here, so they render the same.
+ *
+ * Also loadable from node (module.exports) for tests/test_clientside_parity.py.
+ */
+(function (root) {
+    var MAX_BARS = 200;
+
+    // Amount series kept for update_comparison, like simulation_cache in simulation.py
+    var AMOUNT_CACHE_SIZE = 64;
+    var amount_cache = new Map();
+
+    // same as numpy's around(x, 2): round half to even
+    function round2(x) {
+        var y = x * 100;
+        var r = Math.round(y);
+        if (Math.abs(y % 1) === 0.5) {
+            r = 2 * Math.round(y / 2);
+        }
+        return r / 100;
+    }
+
+    function simulate(p, r, t, con, type_con, start_con, stop_con, n) {
+        var df = {
+            Month: [], Principal: [], Amount: [], Interest: [], Cumulative_Interest: [],
+            Contribution: [], Cumulative_Contribution: [], Amount_Marker: []
+        };
+        var amount = p;
+        var cum_interest_earned = 0;
+        var total_contributions = 0;
+        for (var i = 1; i < t * n + 1; i++) {
+            var contribution = 0;
+            if (!(i % type_con !== 0 || i < start_con || i > stop_con)) {
+                contribution = con;
+                amount += con;
+                total_contributions += con;
+            }
+            var old_amount = amount;
+            amount = amount * (1 + r / n);
+            var interest_earned = amount - old_amount;
+            cum_interest_earned += amount - old_amount;
+
+            df.Month.push(i);
+            df.Principal.push(round2(p));
+            df.Amount.push(round2(amount));
+            df.Interest.push(round2(interest_earned));
+            df.Cumulative_Interest.push(round2(cum_interest_earned));
+            df.Contribution.push(round2(contribution));
+            df.Cumulative_Contribution.push(round2(total_contributions));
+            df.Amount_Marker.push(0);
+        }
+        return df;
+    }
+
+    // Amount series of a parameter list, least recently used first in amount_cache (a Map keeps insertion order)
+    function remember_amount(parameters, amount) {
+        var key = JSON.stringify(parameters);
+        amount_cache.delete(key);
+        amount_cache.set(key, amount);
+        if (amount_cache.size > AMOUNT_CACHE_SIZE) {
+            amount_cache.delete(amount_cache.keys().next().value);
+        }
+        return amount;
+    }
+
+    function cached_amount(parameters) {
+        var amount = amount_cache.get(JSON.stringify(parameters));
+        return remember_amount(parameters, amount || simulate.apply(null, parameters).Amount);
+    }
+
+    // see bar_step in compounding.py
+    function bar_step(periods, n) {
+        if (periods <= MAX_BARS) {
+            return 1;
+        }
+        if (n && n > 1 && Math.ceil(periods / n) <= MAX_BARS) {
+            return n;
+        }
+        return Math.ceil(periods / MAX_BARS);
+    }
+
+    // see CpdResult.bucketed in simulation.py (sums the rounded values here, so cents may differ)
+    function decimate(df, step, sum_cols) {
+        var length = df.Month.length;
+        if (step <= 1 || length === 0) {
+            return df;
+        }
+        var out = {};
+        Object.keys(df).forEach(function (col) {
+            out[col] = [];
+            for (var start = 0; start < length; start += step) {
+                var end = Math.min(start + step, length) - 1;
+                if (sum_cols.indexOf(col) === -1) {
+                    out[col].push(df[col][end]);
+                } else {
+                    var total = 0;
+                    for (var k = start; k <= end; k++) {
+                        total += df[col][k];
+                    }
+                    out[col].push(round2(total));
+                }
+            }
+        });
+        return out;
+    }
+
+    function rows(df, cols) {
+        return df.Month.map(function (_, i) {
+            return cols.map(function (col) { return df[col][i]; });
+        });
+    }
+
+    function fill(skeleton, traces) {
+        var fig = JSON.parse(JSON.stringify(skeleton));
+        traces.forEach(function (values, i) {
+            Object.assign(fig.data[i], values);
+        });
+        return fig;
+    }
+
+    function prevent_update() {
+        var dash_clientside = root.dash_clientside || {};
+        throw dash_clientside.PreventUpdate || new Error('PreventUpdate');
+    }
+
+    // clientside version of update_bar
+    function update_bar(p, r, t, con, type_con, start_con, stop_con, n, skeleton) {
+        var parameters = [p, r, t, con, type_con, start_con, stop_con, n];
+        if (parameters.some(function (x) { return x === null || x === undefined; })) {
+            prevent_update();
+        }
+        var df = simulate(p, r, t, con, type_con, start_con, stop_con, n);
+        // the comparison chart is updated next with these parameters
+        remember_amount(parameters, df.Amount);
+        var bars = decimate(df, bar_step(df.Month.length, n), ['Interest', 'Contribution']);
+        var customdata = rows(bars, ['Amount', 'Principal', 'Cumulative_Interest', 'Cumulative_Contribution']);
+        var fig = fill(skeleton, [
+            {x: bars.Month, y: bars.Principal},
+            {x: bars.Month, y: bars.Cumulative_Contribution},
+            {x: bars.Month, y: bars.Cumulative_Interest, text: bars.Amount, customdata: customdata},
+            {x: bars.Month, y: bars.Amount_Marker, text: bars.Amount, customdata: customdata},
+        ]);
+        return [fig, {parameters: parameters, n: n}];
+    }
+
+    // see strategy_name in compounding.py
+    function strategy_name(k) {
+        return 'Returns ' + (k < 26 ? String.fromCharCode(65 + k) : String(k + 1));
+    }
+
+    // clientside version of update_comparison
+    function update_comparison(datas, ids, skeleton) {
+        if (!datas || !datas.length || datas.some(function (data) { return !data; })) {
+            prevent_update();
+        }
+        // the stores only keep each strategy's parameters (see strategy_store_data in compounding.py), only the
+        // strategies that aren't in amount_cache are simulated again
+        var amounts = datas.map(function (data) { return cached_amount(data.parameters); });
+        var length = Math.max.apply(null, amounts.map(function (amount) { return amount.length; }));
+        var n = datas.every(function (data) { return data.n === datas[0].n; }) ? datas[0].n : 1;
+        var step = bar_step(length, n);
+        var month = [];
+        // last period of every bucket, see comparison_figure
+        for (var start = 0; start < length; start += step) {
+            month.push(Math.min(start + step, length));
+        }
+        var template = JSON.parse(JSON.stringify(skeleton.data[1]));
+        delete template.customdata;
+        template.hovertemplate = '%{y}';
+        var fig = JSON.parse(JSON.stringify(skeleton));
+        fig.data = datas.map(function (data, k) {
+            var amount = amounts[k];
+            var y = month.map(function (m) { return m <= amount.length ? amount[m - 1] : null; });
+            return Object.assign({}, template, {
+                name: strategy_name(ids ? ids[k].index : k), x: month, y: y, text: y,
+            });
+        });
+        return fig;
+    }
+
+    var compounding = {
+        simulate: simulate,
+        cached_amount: cached_amount,
+        update_bar: update_bar,
+        update_comparison: update_comparison,
+    };
+
+    if (typeof module !== 'undefined' && module.exports) {
+        module.exports = compounding;
+    }
+    root.dash_clientside = Object.assign({}, root.dash_clientside, {compounding: compounding});
+})(typeof window !== 'undefined' ? window : this);
@@ -0,0 +1,182 @@
+"""
+Benchmarks for the simulation, figure building and callback paths.
+
+    python bench.py                          # full matrix, writes bench_results.json
+    python bench.py --quick -o quick.json    # smaller matrix
+    python bench.py --compare old.json new.json
+
+Every case records wall time (best and median of --repeat runs), peak python memory (tracemalloc) and, for
+anything that returns a figure, the size of its serialized JSON.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import plotly
+
+### timings are for cold caches, keep the on-disk one (simulation.shared_result_cache) out of it
+os.environ.setdefault('CPD_SHARED_CACHE', '0')
+
+import compounding
+from simulation import checkpoint_cache, cpd_interest_v4_2, growth_tables, simulation_cache
+
+### (t, n) matrix
+BENCH_TIMES = [10, 25, 50, 100]
+BENCH_FREQUENCIES = [1, 12, 52, 365]
+QUICK_TIMES = [10, 65]
+QUICK_FREQUENCIES = [1, 12, 365]
+
+### strategies benchmarked: Mary and John from the README, stretched to t years
+def bench_params(t, n):
+    return (
+        [0, 0.1, t, 2_000, 1, 19 * n, 25 * n, n],
+        [0, 0.1, t, 2_000, 1, 26 * n, 65 * n, n],
+    )
+
+
+def figure_bytes(fig):
+    return len(json.dumps(fig, cls = plotly.utils.PlotlyJSONEncoder))
+
+
+def measure(function, repeat):
+    """
+    Runs function once to warm up (plotly loads its templates lazily), once under tracemalloc for its peak memory,
+    then repeat more times for timings. Quietly, and with cold simulation caches every time.
+    Returns the stats and the last return value.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        simulation_cache.clear()
+        checkpoint_cache.clear()
+        growth_tables.clear()
+        function()
+
+        simulation_cache.clear()
+        checkpoint_cache.clear()
+        growth_tables.clear()
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        times = []
+        for _ in range(repeat):
+            simulation_cache.clear()
+            checkpoint_cache.clear()
+            growth_tables.clear()
+            start = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - start)
+    return {
+        'best_s': min(times),
+        'median_s': statistics.median(times),
+        'peak_bytes': peak,
+    }, result
+
+
+def bench_case(t, n, repeat):
+    params1, params2 = bench_params(t, n)
+    with contextlib.redirect_stdout(io.StringIO()):
+        df1 = cpd_interest_v4_2(*params1)
+        df2 = cpd_interest_v4_2(*params2)
+    merged_df = compounding.merge_cpd_dfs(df1, df2, columns = ['Amount'])
+
+    def callbacks():
+        fig1, data1 = compounding.update_bar(*params1)
+        fig2, data2 = compounding.update_bar(*params2)
+        return [fig1, fig2, compounding.update_comparison([data1, data2])]
+
+    cases = {
+        'cpd_interest_v4_2[loop]': lambda: cpd_interest_v4_2(*params1, engine = 'loop'),
+        'cpd_interest_v4_2[numpy]': lambda: cpd_interest_v4_2(*params1, engine = 'numpy'),
+        'create_cpd_fig_v2': lambda: compounding.create_cpd_fig_v2(df1),
+        'merge_cpd_dfs': lambda: compounding.merge_cpd_dfs(df1, df2),
+        'plot_merged_bar': lambda: compounding.plot_merged_bar(merged_df),
+        'comparison_figure': lambda: compounding.comparison_figure([df1.Amount.to_numpy(), df2.Amount.to_numpy()], n),
+        'callbacks': callbacks,
+    }
+
+    results = []
+    for name, function in cases.items():
+        stats, value = measure(function, repeat)
+        if isinstance(value, list):
+            stats['figure_bytes'] = sum(figure_bytes(fig) for fig in value)
+        elif isinstance(value, dict) or hasattr(value, 'to_plotly_json'):
+            stats['figure_bytes'] = figure_bytes(value)
+        results.append(dict(name = name, t = t, n = n, periods = t * n, **stats))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(times, frequencies, repeat):
+    results = []
+    for t, n in itertools.product(times, frequencies):
+        for case in bench_case(t, n, repeat):
+            results.append(case)
+            print('{name:<26} t={t:<4} n={n:<4} {best_s:9.4f}s {peak_bytes:>12,}B {figure_bytes}'.format(
+                **dict({'figure_bytes': ''}, **case)), file = sys.stderr)
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def compare(old_path, new_path):
+    """
+    Prints new / old for every case and metric both files have.
+    """
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    old_cases = {(case['name'], case['t'], case['n']): case for case in old['results']}
+    print('{} -> {}'.format(old.get('commit'), new.get('commit')))
+    for case in new['results']:
+        before = old_cases.get((case['name'], case['t'], case['n']))
+        if before is None:
+            continue
+        ratios = [
+            '{}={:.2f}x'.format(metric, case[metric] / before[metric])
+            for metric in ['best_s', 'peak_bytes', 'figure_bytes']
+            if case.get(metric) and before.get(metric)
+        ]
+        print('{:<26} t={:<4} n={:<4} {}'.format(case['name'], case['t'], case['n'], ' '.join(ratios)))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default = 'bench_results.json')
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--quick', action = 'store_true', help = 'smaller (t, n) matrix')
+    parser.add_argument('--compare', nargs = 2, metavar = ('OLD', 'NEW'))
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        return compare(*args.compare)
+
+    times, frequencies = (QUICK_TIMES, QUICK_FREQUENCIES) if args.quick else (BENCH_TIMES, BENCH_FREQUENCIES)
+    report = run(times, frequencies, args.repeat)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent = 1)
+    print('wrote {}'.format(args.output), file = sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
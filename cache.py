@@ -0,0 +1,273 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache with hit/miss/eviction counters.
+
+    maxsize: max number of entries kept. The least recently used entry is dropped when this is exceeded.
+    copy: function applied to values on the way in and out, so callers can't mutate what is stored.
+    """
+
+    def __init__(self, maxsize = 128, copy = None):
+        self.maxsize = maxsize
+        self.copy = copy or (lambda value: value)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default = None):
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            value = self._data[key]
+        return self.copy(value)
+
+    def put(self, key, value):
+        value = self.copy(value)
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for key, calling compute() and storing the result on a miss.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is sentinel:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class MmapArrayCache:
+    """
+    Size-bounded cache of lists of 1d arrays in a directory, shared by every process that uses the same directory
+    (eg all gunicorn workers on a host). Each entry is one file: a small header then the raw arrays. get() maps the
+    file and returns read-only views into it, so reading an entry doesn't copy or unpickle anything.
+
+    directory: where the entries are kept
+    maxbytes: total size of the entries. The least recently used ones (by mtime, which a hit refreshes) are deleted
+        when a put goes over it. A file deleted while another process has it mapped stays readable there
+    version: string identifying the code that computes the values (eg a hash of its source). It is part of every
+        entry's file name and header, so entries written by other code are never read: they are misses, and age out
+    evict_every: the directory is scanned (and evicted) every evict_every puts, or sooner when this process' running
+        total goes over maxbytes. Other processes' puts are only seen at a scan, so the directory can run over
+        maxbytes by what the processes write in between
+    """
+    MAGIC = b'CPDARR02'
+    SUFFIX = '.arr'
+    # MAGIC, version digest, array count
+    HEADER = struct.Struct('<8s8sI')
+    DESCRIPTOR = struct.Struct('<4sq')
+    # an eviction deletes entries down to this fraction of maxbytes, so the puts after it don't all scan again
+    EVICT_TO = 0.9
+
+    def __init__(self, directory, maxbytes = 256 * 1024 * 1024, version = '', evict_every = 64):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.version = version
+        self.evict_every = evict_every
+        # directory size at the last scan plus what this process wrote since, None until the first scan
+        self._size = None
+        self._puts = 0
+        self._version_digest = hashlib.sha1(version.encode()).digest()[:8]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr((self.version, key)).encode()).hexdigest() + self.SUFFIX)
+
+    def get(self, key, default = None):
+        """
+        The arrays stored for key, or default. A file that can't be read back (other version, truncated, corrupt)
+        is a miss, and is deleted so the next put replaces it.
+        """
+        path = self._path(key)
+        try:
+            mapped = np.memmap(path, dtype = np.uint8, mode = 'r')
+            arrays = self._unpack(mapped)
+            os.utime(path)
+        except FileNotFoundError:
+            arrays = None
+        except (OSError, ValueError, TypeError, struct.error):
+            arrays = None
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            if arrays is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return default if arrays is None else arrays
+
+    def _unpack(self, mapped):
+        """
+        Views of the arrays in a mapped entry. Raises ValueError if it isn't a complete entry of this version.
+        """
+        if len(mapped) < self.HEADER.size:
+            raise ValueError('truncated header')
+        magic, version, count = self.HEADER.unpack(mapped[:self.HEADER.size].tobytes())
+        if magic != self.MAGIC or version != self._version_digest:
+            raise ValueError('not a {} file of this version'.format(type(self).__name__))
+        offset = self._data_offset(count)
+        if len(mapped) < offset:
+            raise ValueError('truncated header')
+        arrays = []
+        for i in range(count):
+            start = self.HEADER.size + self.DESCRIPTOR.size * i
+            dtype, length = self.DESCRIPTOR.unpack(mapped[start:start + self.DESCRIPTOR.size].tobytes())
+            dtype = np.dtype(dtype.rstrip(b'\0').decode())
+            end = offset + length * dtype.itemsize
+            if length < 0 or end > len(mapped):
+                raise ValueError('truncated data')
+            # plain ndarray views (still backed by the mapping), so results computed from them aren't memmaps
+            arrays.append(mapped[offset:end].view(dtype).view(np.ndarray))
+            offset = end
+        return arrays
+
+    @classmethod
+    def _data_offset(cls, count):
+        # arrays start 16 byte aligned, and every array is a multiple of 8 bytes long
+        return (cls.HEADER.size + cls.DESCRIPTOR.size * count + 15) // 16 * 16
+
+    def put(self, key, arrays):
+        """
+        arrays: list of 1d arrays. Stored as little endian int64 (ints and bools) or float64 (everything else)
+        """
+        arrays = [np.ascontiguousarray(array, dtype = '<i8' if array.dtype.kind in 'iub' else '<f8') for array in arrays]
+        header = self.HEADER.pack(self.MAGIC, self._version_digest, len(arrays))
+        header += b''.join(self.DESCRIPTOR.pack(array.dtype.str.encode(), len(array)) for array in arrays)
+        header = header.ljust(self._data_offset(len(arrays)), b'\0')
+
+        os.makedirs(self.directory, exist_ok = True)
+        fd, tmp = tempfile.mkstemp(dir = self.directory, suffix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            for array in arrays:
+                f.write(array.tobytes())
+        os.replace(tmp, self._path(key))
+
+        size = len(header) + sum(array.nbytes for array in arrays)
+        with self._lock:
+            self._puts += 1
+            scan = self._size is None or self._puts >= self.evict_every or self._size + size > self.maxbytes
+            if not scan:
+                self._size += size
+        if scan:
+            self.evict()
+
+    def get_or_compute(self, key, compute, pack, unpack):
+        """
+        Like LRUCache.get_or_compute. pack turns a value into a list of arrays, unpack turns them back.
+        """
+        arrays = self.get(key)
+        if arrays is not None:
+            return unpack(arrays)
+        value = compute()
+        self.put(key, pack(value))
+        return value
+
+    def _entries(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(self.SUFFIX):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def evict(self):
+        """
+        Scans the directory and, if it's over maxbytes, deletes the least recently used entries down to
+        EVICT_TO * maxbytes.
+        """
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        target = self.maxbytes if total <= self.maxbytes else self.EVICT_TO * self.maxbytes
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                with self._lock:
+                    self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+        with self._lock:
+            self._size = total
+            self._puts = 0
+
+    def clear(self):
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.hits = self.misses = self.evictions = 0
+        self._size = None
+
+    def stats(self):
+        """
+        hits, misses and evictions are this process' own, size and entries are the directory's.
+        """
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'size_bytes': sum(size for _, size, _ in entries),
+            'maxbytes': self.maxbytes,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,174 @@
+"""
+Drops stale callback requests. CPD_COALESCE=0 turns it off (see install).
+
+Every browser gets a session cookie. Each Dash callback request, except the ones only triggered by a timer
+(UNCOALESCED_PROPS), is keyed on (session, the outputs it updates) and given a token; when a newer request for the
+same key comes in, the older one is stale:
+    drop_if_stale() raises PreventUpdate, so a callback can stop between stages (eg after simulating) instead of
+    building a figure nobody will see
+    a stale request that still finishes gets a 204 (Dash's "no update") instead of its response, so a figure
+    from an older request never replaces a newer one
+Keys live in CPD_COALESCE_DIR, one small file per key holding the latest request's token, so a newer request served
+by any gunicorn worker on the host makes the older one stale. CPD_COALESCE_DIR= (empty) keeps them in the process'
+memory instead, which only covers requests served by the same worker (threads).
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import dash
+import flask
+
+ENABLED = os.environ.get('CPD_COALESCE', '1').lower() not in ('0', 'false', 'no')
+
+SESSION_COOKIE = 'cpd_session'
+
+COALESCE_DIR = os.environ.get('CPD_COALESCE_DIR', os.path.join(tempfile.gettempdir(), 'compounding-coalesce'))
+
+### keys of sessions that stopped sending requests are dropped once there are more than this many
+MAX_KEYS = 10_000
+
+### SharedCoalescer: key files untouched for this many seconds are deleted, checked every CLEANUP_EVERY requests
+KEY_TTL = 60 * 60
+CLEANUP_EVERY = 1_000
+
+### requests triggered only by these props (timers like dcc.Interval) are never numbered: a poll tick isn't a newer
+### version of a request that changed the inputs, and must not make it stale (or be dropped for one)
+UNCOALESCED_PROPS = ['n_intervals']
+
+
+class Coalescer:
+    """
+    Latest request number per key.
+    """
+
+    def __init__(self, max_keys = MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._latest = {}
+        self._counter = 0
+
+    def begin(self, key):
+        with self._lock:
+            self._counter += 1
+            # dicts keep insertion order: re-insert so the oldest keys are the first ones
+            self._latest.pop(key, None)
+            self._latest[key] = self._counter
+            while len(self._latest) > self.max_keys:
+                del self._latest[next(iter(self._latest))]
+            return self._counter
+
+    def is_stale(self, key, token):
+        with self._lock:
+            return self._latest.get(key, token) != token
+
+
+class SharedCoalescer:
+    """
+    Latest request token per key, as one file per key in directory, shared by every process on the host.
+    Same interface as Coalescer.
+    """
+
+    def __init__(self, directory = COALESCE_DIR, ttl = KEY_TTL, cleanup_every = CLEANUP_EVERY):
+        self.directory = directory
+        self.ttl = ttl
+        self.cleanup_every = cleanup_every
+        self._lock = threading.Lock()
+        self._count = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def begin(self, key):
+        # unique across threads and processes (forked workers share this object's state)
+        token = uuid.uuid4().hex
+        path = self._path(key)
+        os.makedirs(self.directory, exist_ok = True)
+        tmp_path = '{}.{}.tmp'.format(path, token)
+        with open(tmp_path, 'w') as f:
+            f.write(token)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._count += 1
+            cleanup = self._count % self.cleanup_every == 0
+        if cleanup:
+            self.cleanup()
+        return token
+
+    def is_stale(self, key, token):
+        try:
+            with open(self._path(key)) as f:
+                return f.read() != token
+        except OSError:
+            return False
+
+    def cleanup(self):
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+coalescer = SharedCoalescer(COALESCE_DIR) if COALESCE_DIR else Coalescer()
+
+
+def request_key():
+    """
+    (session, outputs) of the current Dash callback request, or None if it isn't one, has no session yet or was
+    triggered by UNCOALESCED_PROPS only.
+    """
+    request = flask.request
+    session = request.cookies.get(SESSION_COOKIE)
+    if session is None or not request.path.endswith('_dash-update-component'):
+        return None
+    body = request.get_json(silent = True) or {}
+    changed = body.get('changedPropIds') or []
+    if changed and all(prop_id.rsplit('.', 1)[-1] in UNCOALESCED_PROPS for prop_id in changed):
+        return None
+    # outputs has the concrete ids, so pattern-matching callbacks of different strategies don't coalesce together
+    return session, json.dumps(body.get('outputs', body.get('output')), sort_keys = True)
+
+
+def is_stale():
+    token = flask.g.get('cpd_coalesce_token') if flask.has_request_context() else None
+    return token is not None and coalescer.is_stale(flask.g.cpd_coalesce_key, token)
+
+
+def drop_if_stale():
+    """
+    Call between the stages of a callback: raises PreventUpdate if a newer request for the same outputs came in.
+    """
+    if is_stale():
+        raise dash.exceptions.PreventUpdate
+
+
+def install(app):
+    """
+    Hooks the session cookie and request numbering into a Dash app's Flask server.
+    """
+    server = app.server
+
+    @server.before_request
+    def begin_request():
+        key = request_key()
+        if key is not None:
+            flask.g.cpd_coalesce_key = key
+            flask.g.cpd_coalesce_token = coalescer.begin(key)
+
+    @server.after_request
+    def finish_request(response):
+        if response.status_code == 200 and is_stale():
+            response = flask.Response(status = 204)
+        if SESSION_COOKIE not in flask.request.cookies:
+            response.set_cookie(SESSION_COOKIE, uuid.uuid4().hex, httponly = True, samesite = 'Lax')
+        return response
+
+    return server
@@ -1,12 +1,32 @@
+import functools
+import json
+import math
+import os
+
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-import plotly.express as px
 
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output
+from dash.dependencies import ALL, MATCH, Input, Output, State
+
+import coalescing
+import export
+import fast_json
+import instrumentation
+from instrumentation import timed
+from jobs import job_manager, submit_monte_carlo
+from goalseek import goal_seek
+from montecarlo import monte_carlo
+from simulation import (
+    CPD_COLUMNS, PARAM_NAMES, cpd_result_cached, sweep_final_amount, sweep_values,
+)
+
+### CPD_CLIENTSIDE=1 runs the simulation and builds the figures in the browser instead of on the server
+CLIENTSIDE = os.environ.get('CPD_CLIENTSIDE', '').lower() in ('1', 'true', 'yes')
 
 ### create app
 app = dash.Dash(
@@ -18,6 +38,21 @@ app = dash.Dash(
 )
 server = app.server
 
+### orjson based encoder for callback responses, see fast_json.py. CPD_FAST_JSON=0 turns it off
+if fast_json.ENABLED:
+    fast_json.install()
+
+### drops callback requests that a newer one for the same outputs (and browser) has replaced, see coalescing.py
+if coalescing.ENABLED:
+    coalescing.install(app)
+
+### /export: simulation results as a CSV / Parquet download, see export.py
+export.install(server)
+
+### CPD_INSTRUMENT=1: per-stage Server-Timing headers, /_metrics histograms and the slow request profiler
+if instrumentation.ENABLED:
+    instrumentation.install(app)
+
 
 ### import and clean data
 # def compound_interest(principal, rate, time, dca = 0, n = 1):
@@ -44,71 +79,6 @@ server = app.server
 #     amount = main_val + add_val
 #     return amount
 
-def cpd_interest_v4_2(p, r, t, con, type_con, start_con, stop_con, n):
-    """
-    p: principal
-    r: interest rate in decimal (3.75% -> 0.0375)
-    t: time in years (do 1/12 for 1 month)
-    con: contribution made
-    type_con: int, how many times a contribution is made in a year (1 == monthly, 3 == quarterly)
-    stop_con: months before stopping contributions
-    n: number of times compounded per year (12 for monthly, 365 for daily)
-
-    return: amount = cpd growth of principal + cpd growth of contributions
-    """
-    # try and start simple first: basic compounding
-    months = []
-    principals = [p for i in range(1, t*n + 1)]
-
-    amount = p
-    amounts = []
-
-    interest_earned = 0
-    interests = []
-    cum_interest_earned = 0
-    cum_interests = []
-
-    total_contributions = 0
-    contributions = []
-    cum_contributions = []
-    for i in range(1, t * n + 1):
-        months.append(i)
-
-        # check when to contribute
-        if i % type_con != 0 or i < start_con or i > stop_con:
-            amount += 0
-            total_contributions += 0
-            contributions.append(0)
-            cum_contributions.append(total_contributions)
-        else:
-            # print('adding con')
-            amount += con
-            total_contributions += con
-            contributions.append(con)
-            cum_contributions.append(total_contributions)
-
-
-        old_amount = amount
-        amount = amount * (1 + r/n)
-        interest_earned = (amount - old_amount)
-        interests.append(interest_earned)
-        cum_interest_earned += amount - old_amount
-
-        cum_interests.append(cum_interest_earned)
-        # print(amount)
-        amounts.append(amount)
-
-    print("Final Amount: ", amount)
-    print("Total interest earned: ", cum_interest_earned)
-    print("Total contributions: ", total_contributions)
-
-    df = pd.DataFrame(list(zip(months, principals, amounts, interests, cum_interests, contributions, cum_contributions)), columns = ['Month', 'Principal', 'Amount', 'Interest', 'Cumulative_Interest', 'Contribution', 'Cumulative_Contribution'])
-    df = df.round(2)
-
-    ### this creates an empty col of 0s. This allows for you to add an "empty bar" that is able to stack on the bar chart and display the "Amount" in the hover with minimal tinkering.
-    df['Amount_Marker'] = 0
-
-    return df
 # def cpd_interest_v4(p, r, t, con, type_con, stop_con, n):
 #     """
 #     p: principal
@@ -181,6 +151,38 @@ def cpd_interest_v4_2(p, r, t, con, type_con, start_con, stop_con, n):
 #         )
 #     return fig
 
+### largest sweep grid is MAX_SWEEP_STEPS x MAX_SWEEP_STEPS final amounts, all computed in one final_amount_batch call
+MAX_SWEEP_STEPS = 200
+
+### cap on paths per fan chart request. Runs of more than MC_SYNC_CELLS (paths x periods) simulated values go to the
+### job pool (jobs.py) and are polled, smaller ones (well under a second) are run inline
+MAX_MC_PATHS = 1_000_000
+MC_SYNC_CELLS = 20_000_000
+### fixed so a seed gives the same chart whether the run was done inline or as a job
+MC_SHARDS = 8
+MC_POLL_INTERVAL = 500
+
+### strategies on the page when it loads: Mary and John from the info card. Added strategies start as a copy of Mary
+STRATEGY_DEFAULTS = [
+    [0.00, 0.1, 65, 2_000, 1, 19, 25, 1],
+    [0, 0.1, 65, 2_000, 1, 26, 65, 1],
+]
+MAX_STRATEGIES = 16
+
+### long horizons (eg daily compounding over 65 years) would otherwise mean ~24k bars per trace and MBs of figure json
+MAX_BARS = 200
+
+def bar_step(periods, n = 1, max_bars = MAX_BARS):
+    """
+    How many periods go into one bar so that a chart has at most max_bars bars.
+    Uses yearly buckets (n periods) when that is enough, otherwise the smallest step that fits.
+    """
+    if periods <= max_bars:
+        return 1
+    if n and n > 1 and math.ceil(periods / n) <= max_bars:
+        return int(n)
+    return math.ceil(periods / max_bars)
+
 def create_cpd_fig_v2(df):
     fig = go.Figure()
     ### trying to get a nice hover template which includes
@@ -344,116 +346,161 @@ start_con_label = html.Label('Start Contribution at period: ')
 stop_con_label = html.Label('Stop Contribution at period: ')
 n_label = html.Label('Frequency of Compounding: ')
 
-principal_input = dcc.Input(
-    id = 'principal_input',
+### strategy inputs. Every strategy has one of each, with id {'type': <name>, 'index': <strategy index>} so the
+### callbacks can match them with MATCH / ALL. In cpd_interest_v4_2's parameter order
+STRATEGY_INPUTS = ['principal_input', 'rate_input', 'time_input', 'con_input', 'type_con_input', 'start_con_input', 'stop_con_input', 'n_input']
+strategy_labels = {
+    'principal_input': principal_label,
+    'rate_input': rate_label,
+    'time_input': time_label,
+    'con_input': con_label,
+    'type_con_input': type_con_label,
+    'start_con_input': start_con_label,
+    'stop_con_input': stop_con_label,
+    'n_input': n_label,
+}
+strategy_input_props = {
+    'principal_input': dict(max = 1_000_000, min = -1_000_000),
+    'time_input': dict(step = 1),
+    'type_con_input': dict(min = 1),
+}
+
+def create_strategy_input(name, index, value):
+    return dcc.Input(
+        id = {'type': name, 'index': index},
+        type = 'number',
+        debounce = True,
+        value = value,
+        **strategy_input_props.get(name, {})
+    )
+
+
+### monte carlo inputs. Uses strategy A's inputs, with rate as the mean annual return
+mc_sigma_label = html.Label('Volatility of returns: ')
+mc_paths_label = html.Label('Simulated paths: ')
+mc_seed_label = html.Label('Random seed: ')
+
+mc_sigma_input = dcc.Input(
+    id = 'mc_sigma_input',
     type = 'number',
-    value = 0.00,
-    max = 1_000_000,
-    min = -1_000_000,
+    debounce = True,
+    value = 0.15,
+    min = 0,
 )
-rate_input = dcc.Input(
-    id = 'rate_input',
+mc_paths_input = dcc.Input(
+    id = 'mc_paths_input',
     type = 'number',
-    value = 0.1,
+    debounce = True,
+    value = 2_000,
+    min = 1,
+    max = MAX_MC_PATHS,
+    step = 1,
 )
-time_input = dcc.Input(
-    id = 'time_input',
+mc_seed_input = dcc.Input(
+    id = 'mc_seed_input',
     type = 'number',
-    value = 65,
+    debounce = True,
+    value = 0,
+    min = 0,
     step = 1,
 )
 
-con_input = dcc.Input(
-    id = 'con_input',
-    type = 'number',
-    value = 2_000,
+### sweep inputs. The sweep varies 2 of strategy A's parameters and keeps the rest
+sweep_param_options = [
+    {'label': 'Principal', 'value': 'p'},
+    {'label': 'Rate', 'value': 'r'},
+    {'label': 'Time', 'value': 't'},
+    {'label': 'Contribution', 'value': 'con'},
+    {'label': 'Frequency of Contribution', 'value': 'type_con'},
+    {'label': 'Start Contribution at period', 'value': 'start_con'},
+    {'label': 'Stop Contribution at period', 'value': 'stop_con'},
+    {'label': 'Frequency of Compounding', 'value': 'n'},
+]
+sweep_x_label = html.Label('Sweep (x axis): ')
+sweep_x_range_label = html.Label('From / To: ')
+sweep_y_label = html.Label('Sweep (y axis): ')
+sweep_y_range_label = html.Label('From / To: ')
+sweep_steps_label = html.Label('Steps per axis: ')
+
+sweep_x_input = dcc.Dropdown(
+    id = 'sweep_x_input',
+    options = sweep_param_options,
+    value = 'start_con',
+    clearable = False,
+    style = {'width': '100%', 'color': 'black'},
 )
-type_con_input = dcc.Input(
-    id = 'type_con_input',
-    type = 'number',
-    value = 1,
-    min = 1,
+sweep_x_range_input = html.Div(
+    [
+        dcc.Input(id = 'sweep_x_min_input', type = 'number', debounce = True, value = 1),
+        dcc.Input(id = 'sweep_x_max_input', type = 'number', debounce = True, value = 60),
+    ]
 )
-start_con_input = dcc.Input(
-    id = 'start_con_input',
-    type = 'number',
-    value = 19,
+sweep_y_input = dcc.Dropdown(
+    id = 'sweep_y_input',
+    options = sweep_param_options,
+    value = 'r',
+    clearable = False,
+    style = {'width': '100%', 'color': 'black'},
 )
-stop_con_input = dcc.Input(
-    id = 'stop_con_input',
-    type = 'number',
-    value = 25,
+sweep_y_range_input = html.Div(
+    [
+        dcc.Input(id = 'sweep_y_min_input', type = 'number', debounce = True, value = 0.01),
+        dcc.Input(id = 'sweep_y_max_input', type = 'number', debounce = True, value = 0.15),
+    ]
 )
-n_input = dcc.Input(
-    id = 'n_input',
+sweep_steps_input = dcc.Input(
+    id = 'sweep_steps_input',
     type = 'number',
-    value = 1,
+    debounce = True,
+    value = 100,
+    min = 2,
+    max = MAX_SWEEP_STEPS,
 )
 
+### goal seek inputs. Solves for one of strategy A's parameters, the others are taken from its inputs
+goal_target_label = html.Label('Target amount: ')
+goal_solve_for_label = html.Label('Solve for: ')
 
-### bar 2 inputs
-principal_input2 = dcc.Input(
-    id = 'principal_input2',
-    type = 'number',
-    value = 0,
-    max = 1_000_000,
-    min = -1_000_000,
-)
-rate_input2 = dcc.Input(
-    id = 'rate_input2',
-    type = 'number',
-    value = 0.1,
-)
-time_input2 = dcc.Input(
-    id = 'time_input2',
-    type = 'number',
-    value = 65,
-    step = 1,
-)
-
-con_input2 = dcc.Input(
-    id = 'con_input2',
-    type = 'number',
-    value = 2_000,
-)
-type_con_input2 = dcc.Input(
-    id = 'type_con_input2',
-    type = 'number',
-    value = 1,
-    min = 1,
-)
-start_con_input2 = dcc.Input(
-    id = 'start_con_input2',
-    type = 'number',
-    value = 26,
-)
-stop_con_input2 = dcc.Input(
-    id = 'stop_con_input2',
+goal_target_input = dcc.Input(
+    id = 'goal_target_input',
     type = 'number',
-    value = 65,
+    debounce = True,
+    value = 1_000_000,
 )
-n_input2 = dcc.Input(
-    id = 'n_input2',
-    type = 'number',
-    value = 1,
+goal_solve_for_input = dcc.Dropdown(
+    id = 'goal_solve_for_input',
+    options = [option for option in sweep_param_options if option['value'] in ['con', 'r', 'start_con', 't']],
+    value = 'con',
+    clearable = False,
+    style = {'width': '100%', 'color': 'black'},
 )
 
 ### callbacks
-def merge_cpd_dfs(df1, df2):
-    # df1 more than df2, need to pad df2
-    len1 = len(df1)
-    len2 = len(df2)
-    # if len1 > len2:
-    #     print('len1 > len2')
-
-    #     df2 = df2.append(df2.iloc[[-1] * (len1 - len2)]).reset_index(drop=True)
-    #     print(len(df2))
-    # elif len1 < len2:
-    #     df1 = df1.append(df1.iloc[[-1] * (len2 - len1)]).reset_index(drop=True)
-    
-    merged_df = df1.merge(df2, on = 'Month', how = 'outer')
-    merged_df = merged_df.round(2)
-    return merged_df
+def align_amounts(amounts):
+    """
+    amounts: list of K per-period arrays, one per strategy, possibly of different lengths
+    return: (T, K) array, T the longest horizon. Shorter strategies are padded with NaN
+    """
+    width = max((len(values) for values in amounts), default = 0)
+    aligned = np.full((width, len(amounts)), np.nan)
+    for k, values in enumerate(amounts):
+        aligned[:len(values), k] = values
+    return aligned
+
+def merge_cpd_dfs(df1, df2, columns = None):
+    """
+    Month plus `columns` (default: every other column) of both frames side by side with _x / _y suffixes, the
+    shorter one padded with NaN and rounded to 2, like an outer merge on Month.
+    Month is 1..len on both sides, so this lines rows up by position instead of joining on Month.
+    """
+    if columns is None:
+        columns = [col for col in df1.columns if col != 'Month' and col in df2.columns]
+    aligned = {col: align_amounts([df1[col].to_numpy(dtype = float), df2[col].to_numpy(dtype = float)]) for col in columns}
+    merged_df = pd.DataFrame({'Month': np.arange(1, max(len(df1), len(df2)) + 1)})
+    for k, suffix in enumerate(['_x', '_y']):
+        for col, values in aligned.items():
+            merged_df[col + suffix] = values[:, k]
+    return merged_df.round(2)
 
 
 def plot_merged_bar(df):
@@ -513,57 +560,362 @@ def plot_merged_bar(df):
     return fig
 
 
-### function to update all bars
+### the figures above as plain dicts, without going through plotly's validators on every callback.
+### The styling comes from an empty figure built once by create_cpd_fig_v2 / plot_merged_bar, only the data is filled in
+@functools.lru_cache(maxsize = None)
+def cpd_figure_skeleton():
+    return create_cpd_fig_v2(pd.DataFrame(columns = CPD_COLUMNS + ['Amount_Marker'])).to_plotly_json()
+
+@functools.lru_cache(maxsize = None)
+def merged_figure_skeleton():
+    return plot_merged_bar(pd.DataFrame(columns = ['Month', 'Amount_x', 'Amount_y'])).to_plotly_json()
+
+def fill_figure(skeleton, traces):
+    # the layout (and its template) is shared between figures, it is only ever read
+    return {
+        'data': [dict(trace, **values) for trace, values in zip(skeleton['data'], traces)],
+        'layout': skeleton['layout'],
+    }
+
+def cpd_figure(df):
+    """
+    Same figure as create_cpd_fig_v2(df), as a dict.
+    """
+    month = df.Month.to_numpy()
+    customdata = df[['Amount', 'Principal', 'Cumulative_Interest', 'Cumulative_Contribution']].to_numpy()
+    # plotly stores text as strings
+    text = df.Amount.astype(str).tolist()
+    return fill_figure(cpd_figure_skeleton(), [
+        {'x': month, 'y': df.Principal.to_numpy()},
+        {'x': month, 'y': df.Cumulative_Contribution.to_numpy()},
+        {'x': month, 'y': df.Cumulative_Interest.to_numpy(), 'customdata': customdata, 'text': text},
+        {'x': month, 'y': df.Amount_Marker.to_numpy(), 'customdata': customdata, 'text': text},
+    ])
+
+def strategy_name(k):
+    # Returns A, Returns B, ... like plot_merged_bar, then numbers once the letters run out
+    return 'Returns ' + (chr(ord('A') + k) if k < 26 else str(k + 1))
+
+def comparison_figure(amounts, n = 1, names = None):
+    """
+    plot_merged_bar for any number of strategies, as a dict. amounts: list of Amount arrays, one per strategy.
+    names: trace names, defaults to strategy_name of each position.
+    Each trace's hover shows its own y instead of carrying every strategy's amounts as customdata (K^2 values).
+    """
+    aligned = align_amounts(amounts)
+    step = bar_step(len(aligned), n)
+    if step > 1:
+        ends = np.minimum(np.arange(step, len(aligned) + step, step), len(aligned)) - 1
+        aligned = aligned[ends]
+        month = ends + 1
+    else:
+        month = np.arange(1, len(aligned) + 1)
+
+    skeleton = merged_figure_skeleton()
+    template = {key: value for key, value in skeleton['data'][1].items() if key != 'customdata'}
+    template['hovertemplate'] = '%{y}'
+    traces = [
+        dict(template, name = names[k] if names else strategy_name(k), x = month, y = aligned[:, k], text = aligned[:, k].astype(str).tolist())
+        for k in range(aligned.shape[1])
+    ]
+    return {'data': traces, 'layout': skeleton['layout']}
+
+
+### what a strategy keeps in its dcc.Store for the comparison chart: its parameters, not its result. The comparison
+### callback gets the results back from simulation_cache, so no per-period series goes to the browser and back
+def strategy_store_data(parameters):
+    return {
+        'parameters': list(parameters),
+        'n': parameters[-1],
+    }
+
+def update_strategy(parameters):
+    # if null vals, dont update the graph
+    if None in parameters:
+        raise dash.exceptions.PreventUpdate
+    with timed('simulate'):
+        result = cpd_result_cached(*parameters)
+    coalescing.drop_if_stale()
+    n = parameters[-1]
+    with timed('build_figure'):
+        fig = cpd_figure(result.bucketed(bar_step(len(result), n)))
+    return [fig, strategy_store_data(parameters)]
+
+
+def update_bar(principal, rate, time, con, type_con, start_con, stop_con, n):
+    return update_strategy([principal, rate, time, con, type_con, start_con, stop_con, n])
+
+
+def update_comparison(datas, ids = None):
+    """
+    Comparison chart of any number of strategy stores (see strategy_store_data).
+    ids: the stores' ids, to name each strategy after its card
+    """
+    if not datas or not all(datas):
+        raise dash.exceptions.PreventUpdate
+    with timed('simulate'):
+        # simulation_cache hits: the strategies' own callbacks just ran these
+        amounts = [cpd_result_cached(*data['parameters']).amount.round(2) for data in datas]
+    # only bucket by year when all strategies agree on what a year is
+    frequencies = {data.get('n') for data in datas}
+    n = frequencies.pop() if len(frequencies) == 1 else 1
+    names = [strategy_name(id['index']) for id in ids] if ids else None
+    with timed('build_figure'):
+        return comparison_figure(amounts, n, names)
+
+
+### empty figures. In clientside mode the browser fills in the data (assets/compounding.js), so the styling stays defined here
+def figure_skeletons():
+    return {
+        'cpd': cpd_figure_skeleton(),
+        'merged': merged_figure_skeleton(),
+    }
+
+
+def strategy_inputs(index):
+    return [Input({'type': name, 'index': index}, 'value') for name in STRATEGY_INPUTS]
+
+
+### each strategy only reruns its own simulation (MATCH). The comparison chart is rebuilt from all the stores (ALL)
+strategy_outputs = [
+    Output({'type': 'cpd_bar', 'index': MATCH}, 'figure'),
+    Output({'type': 'cpd_store', 'index': MATCH}, 'data'),
+]
+merged_output = Output('merged_bar', 'figure')
+merged_inputs = [
+    Input({'type': 'cpd_store', 'index': ALL}, 'data'),
+]
+merged_states = [
+    State({'type': 'cpd_store', 'index': ALL}, 'id'),
+]
+
+if CLIENTSIDE:
+    ### the strategy charts and the comparison are recomputed in the browser. The sweep, fan chart and goal seek
+    ### callbacks stay on the server
+    skeleton_state = State('figure_skeletons', 'data')
+    app.clientside_callback(
+        """function() {
+            var args = Array.prototype.slice.call(arguments);
+            return dash_clientside.compounding.update_bar.apply(null, args.slice(0, 8).concat([args[8].cpd]));
+        }""",
+        strategy_outputs, strategy_inputs(MATCH), [skeleton_state],
+    )
+    app.clientside_callback(
+        """function(datas, ids, skeletons) {
+            return dash_clientside.compounding.update_comparison(datas, ids, skeletons.merged);
+        }""",
+        merged_output, merged_inputs, merged_states + [skeleton_state],
+    )
+else:
+    app.callback(strategy_outputs, strategy_inputs(MATCH))(update_bar)
+    app.callback(merged_output, merged_inputs, merged_states)(update_comparison)
+
+
 @app.callback(
+    Output('strategy_cards', 'children'),
     [
-        Output('cpd_bar', 'figure'),
-        Output('cpd_bar2', 'figure'),
-        Output('merged_bar', 'figure'),
+        Input('add_strategy', 'n_clicks'),
+        Input({'type': 'remove_strategy', 'index': ALL}, 'n_clicks'),
     ],
     [
-        Input('principal_input', 'value'),
-        Input(component_id='rate_input', component_property='value'),
-        Input('time_input', 'value'),
-
-        Input('con_input', 'value'),
-        Input('type_con_input', 'value'),
-        Input('start_con_input', 'value'),
-        Input('stop_con_input', 'value'),
-        Input('n_input', 'value'),
-
-        Input('principal_input2', 'value'),
-        Input(component_id='rate_input2', component_property='value'),
-        Input('time_input2', 'value'),
-
-        Input('con_input2', 'value'),
-        Input('type_con_input2', 'value'),
-        Input('start_con_input2', 'value'),
-        Input('stop_con_input2', 'value'),
-        Input('n_input2', 'value'),
+        State('strategy_cards', 'children'),
     ],
-    # prevent_initial_callback = True,
+    prevent_initial_call = True,
+)
+def update_strategy_cards(add_clicks, remove_clicks, cards):
+    """
+    Adds a strategy card (a copy of the first default strategy) or removes the one whose button was clicked.
+    Only the new card's callbacks run; the other strategies keep their figures and stores.
+    """
+    triggered = dash.callback_context.triggered
+    if [trigger['prop_id'] for trigger in triggered] == ['add_strategy.n_clicks']:
+        if len(cards) >= MAX_STRATEGIES:
+            raise dash.exceptions.PreventUpdate
+        # n_clicks only goes up, so every card gets a new index
+        return cards + [strategy_card(len(STRATEGY_DEFAULTS) - 1 + add_clicks, STRATEGY_DEFAULTS[0])]
+
+    # new remove buttons also trigger this, with n_clicks still None
+    removed = [json.loads(trigger['prop_id'].rsplit('.', 1)[0])['index'] for trigger in triggered if trigger['value']]
+    if not removed:
+        raise dash.exceptions.PreventUpdate
+    return [card for card in cards if card['props']['id']['index'] not in removed]
+
+def plot_sweep_heatmap(x_name, x_values, y_name, y_values, z):
+    labels = {option['value']: option['label'] for option in sweep_param_options}
+    fig = go.Figure(
+        go.Heatmap(
+            x = x_values, y = y_values, z = z
+            , colorscale = 'Viridis'
+            , colorbar = dict(title = 'Amount')
+            , hovertemplate = labels[x_name] + ': %{x}<br>' + labels[y_name] + ': %{y}<br>Amount: %{z:.3s}<extra></extra>'
+        )
+    )
+    fig.update_layout(template = 'plotly_dark')
+    fig.update_layout(
+        title="Final Amount",
+        title_x = 0.5,
+        xaxis_title=labels[x_name],
+        yaxis_title=labels[y_name],
+    )
+    return fig
+
+
+@app.callback(
+    Output('sweep_heatmap', 'figure'),
+    [
+        Input('sweep_x_input', 'value'),
+        Input('sweep_x_min_input', 'value'),
+        Input('sweep_x_max_input', 'value'),
+        Input('sweep_y_input', 'value'),
+        Input('sweep_y_min_input', 'value'),
+        Input('sweep_y_max_input', 'value'),
+        Input('sweep_steps_input', 'value'),
+    ] + strategy_inputs(0),
 )
-def update_bars(
-    principal, rate, time, con, type_con, start_con, stop_con, n, 
-    principal2, rate2, time2, con2, type_con2, start_con2, stop_con2, n2):
+def update_sweep(x_name, x_min, x_max, y_name, y_min, y_max, steps, *base_values):
     # if null vals, dont update the graph
-    parameters = [
-        principal, rate, time, con, type_con, start_con, stop_con, n, 
-        principal2, rate2, time2, con2, type_con2, start_con2, stop_con2, n2
-        ]
-    if None in parameters:
+    if None in [x_name, x_min, x_max, y_name, y_min, y_max, steps, *base_values] or x_name == y_name:
         raise dash.exceptions.PreventUpdate
-    else:
-        df1 = cpd_interest_v4_2(principal, rate, time, con, type_con, start_con, stop_con, n)
-        fig1 = create_cpd_fig_v2(df1)
+    steps = min(max(int(steps), 2), MAX_SWEEP_STEPS)
+    base = dict(zip(PARAM_NAMES, base_values))
+
+    x_values = sweep_values(x_name, x_min, x_max, steps)
+    y_values = sweep_values(y_name, y_min, y_max, steps)
+    with timed('simulate'):
+        z = sweep_final_amount(base, x_name, x_values, y_name, y_values)
+    coalescing.drop_if_stale()
+    with timed('build_figure'):
+        return plot_sweep_heatmap(x_name, x_values, y_name, y_values, z)
+
+
+def goal_seek_text(solve_for, value, type_con):
+    if solve_for == 'con':
+        return 'Contribute {:,.2f} every {:g} period(s)'.format(value, type_con)
+    if solve_for == 'r':
+        return 'Needs a rate of {:.2%}'.format(value)
+    if solve_for == 'start_con':
+        return 'Start contributing by period {}'.format(value)
+    return 'Reached after {} years'.format(value)
+
+
+@app.callback(
+    Output('goal_result', 'children'),
+    [
+        Input('goal_target_input', 'value'),
+        Input('goal_solve_for_input', 'value'),
+    ] + strategy_inputs(0),
+)
+def update_goal_seek(target, solve_for, *base_values):
+    # if null vals, dont update
+    if None in [target, solve_for, *base_values]:
+        raise dash.exceptions.PreventUpdate
+    with timed('simulate'):
+        try:
+            value = goal_seek(target, solve_for, *base_values)
+        except ValueError as error:
+            return 'Not reachable: {}'.format(error)
+    type_con = base_values[PARAM_NAMES.index('type_con')]
+    return goal_seek_text(solve_for, value, type_con)
+
+
+def plot_fan_chart(result):
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(
+        name = 'p95', x = result.months, y = result.bands[95]
+        , mode = 'lines', line = dict(width = 0.5, color = 'rgb(99, 110, 250)')
+    ))
+    fig.add_trace(go.Scatter(
+        name = 'p5', x = result.months, y = result.bands[5]
+        , mode = 'lines', line = dict(width = 0.5, color = 'rgb(99, 110, 250)')
+        , fill = 'tonexty', fillcolor = 'rgba(99, 110, 250, 0.3)'
+    ))
+    fig.add_trace(go.Scatter(
+        name = 'Median', x = result.months, y = result.bands[50]
+        , mode = 'lines', line = dict(width = 2, color = 'rgb(239, 85, 59)')
+    ))
+
+    fig.update_layout(template = 'plotly_dark')
+    fig.update_layout(
+        title="Range of outcomes ({:,} paths)".format(result.paths),
+        title_x = 0.5,
+        xaxis_title="Time Periods",
+        yaxis_title="Amount",
+        hovermode = 'x unified',
+    )
+    fig.update_layout(legend=dict(
+        orientation="h",
+        yanchor="bottom",
+        y= -0.7,
+        xanchor="right",
+        x=1
+    ))
+    return fig
 
-        df2 = cpd_interest_v4_2(principal2, rate2, time2, con2, type_con2, start_con2, stop_con2, n2)
-        fig2 = create_cpd_fig_v2(df2)
 
-        merged_df = merge_cpd_dfs(df1, df2)
-        merged_fig = plot_merged_bar(merged_df)
+@app.callback(
+    [
+        Output('mc_fan', 'figure'),
+        Output('mc_job', 'data'),
+        Output('mc_poll', 'disabled'),
+        Output('mc_progress', 'children'),
+    ],
+    strategy_inputs(0) + [
+        Input('mc_sigma_input', 'value'),
+        Input('mc_paths_input', 'value'),
+        Input('mc_seed_input', 'value'),
+        Input('mc_poll', 'n_intervals'),
+    ],
+    [
+        State('mc_job', 'data'),
+    ],
+)
+def update_fan_chart(principal, rate, time, con, type_con, start_con, stop_con, n, sigma, paths, seed, n_intervals, job):
+    """
+    Small runs are simulated right away. Bigger ones are submitted to the job pool and this callback is then
+    re-triggered by the mc_poll interval until the job is done, so the worker isn't blocked in the meantime.
+    mc_job holds the job id and the inputs it was submitted for: a poll for a job that isn't the one for the
+    current inputs (a newer one was submitted since) leaves mc_job and mc_poll to the request that submitted it.
+    """
+    inputs = [principal, rate, time, con, type_con, start_con, stop_con, n, sigma, paths, seed]
+    triggered = [trigger['prop_id'] for trigger in dash.callback_context.triggered]
+    if triggered == ['mc_poll.n_intervals']:
+        if not isinstance(job, dict) or job.get('inputs') != inputs:
+            return [dash.no_update] * 4
+        status = job_manager.status(job['id'])
+        if status['state'] == 'running':
+            return [dash.no_update, dash.no_update, False, 'Simulating... {:.0%}'.format(job_manager.progress(job['id']))]
+        if status['state'] != 'done':
+            return [dash.no_update, None, True, 'Simulation {}'.format(status['state'])]
+        with timed('build_figure'):
+            return [plot_fan_chart(job_manager.result(job['id'])), None, True, '']
 
-        return [fig1, fig2, merged_fig]
+    # if null vals, dont update the graph
+    parameters = inputs[:8]
+    if None in inputs:
+        raise dash.exceptions.PreventUpdate
+    # a newer run replaces the job in flight, stop it instead of letting it hold the pool
+    if isinstance(job, dict) and job.get('id'):
+        job_manager.cancel(job['id'])
+    paths = min(max(int(paths), 1), MAX_MC_PATHS)
+    mc_kwargs = dict(sigma = sigma, paths = paths, seed = int(seed), shards = MC_SHARDS, max_recorded = MAX_BARS)
+    if paths * time * n <= MC_SYNC_CELLS:
+        with timed('simulate'):
+            result = monte_carlo(*parameters, **mc_kwargs)
+        coalescing.drop_if_stale()
+        with timed('build_figure'):
+            return [plot_fan_chart(result), None, True, '']
+    job_id = submit_monte_carlo(*parameters, **mc_kwargs)
+    return [dash.no_update, {'id': job_id, 'inputs': inputs}, False, 'Simulating... 0%']
+
+### builds what would otherwise be built by the first requests: the figure skeletons (plotly's validators, the
+### plotly_dark template), a heatmap, a fan chart and a goal seek. wsgi.py runs it before gunicorn forks the workers
+def warm_up():
+    parameters = STRATEGY_DEFAULTS[0]
+    figure_skeletons()
+    update_strategy(parameters)
+    plot_sweep_heatmap('start_con', [1, 2], 'r', [0.01, 0.02], np.zeros((2, 2)))
+    plot_fan_chart(monte_carlo(*parameters, sigma = 0.15, paths = 16, shards = 1, max_recorded = MAX_BARS))
+    goal_seek(1_000_000, 'r', *parameters)
 
 ### app layout and bigger components
 def create_label_input_col(x_label, x_input):
@@ -603,111 +955,163 @@ def create_label_input_col(x_label, x_input):
 
     return col
 
-### row of inputs for first bar chart
-input_label_row = dbc.Row(
+### row of inputs for the monte carlo fan chart
+mc_input_row = dbc.Row(
+        [
+            create_label_input_col(mc_sigma_label, mc_sigma_input),
+            create_label_input_col(mc_paths_label, mc_paths_input),
+            create_label_input_col(mc_seed_label, mc_seed_input),
+        ]
+    )
+
+### one card per strategy: its bar chart and inputs. Strategy A (index 0) also has the monte carlo fan chart, and
+### the sweep uses its inputs, so it can't be removed
+def strategy_card(index, values):
+    input_row = dbc.Row(
         [
-            create_label_input_col(principal_label, principal_input),
-            create_label_input_col(rate_label, rate_input),
-            create_label_input_col(time_label, time_input),
-            create_label_input_col(n_label, n_input),
-
-            create_label_input_col(con_label, con_input),
-            create_label_input_col(type_con_label, type_con_input),
-            create_label_input_col(start_con_label, start_con_input),
-            create_label_input_col(stop_con_label, stop_con_input),
+            create_label_input_col(strategy_labels[name], create_strategy_input(name, index, values[STRATEGY_INPUTS.index(name)]))
+            for name in ['principal_input', 'rate_input', 'time_input', 'n_input', 'con_input', 'type_con_input', 'start_con_input', 'stop_con_input']
+        ]
+    )
+    bar = [
+        dcc.Graph(
+            id = {'type': 'cpd_bar', 'index': index},
+            figure = {}
+        ),
+        dcc.Store(id = {'type': 'cpd_store', 'index': index}),
+    ]
+
+    if index == 0:
+        body = [
+            dbc.Row(
+                [
+                    dbc.Col(
+                        bar,
+                        lg = 7,
+                        xs = 12,
+                    ),
+                    ### fan chart of the same strategy with random returns
+                    dbc.Col(
+                        [
+                            dcc.Graph(
+                                id = 'mc_fan',
+                                figure = {}
+                            ),
+                            html.Div(id = 'mc_progress', style = {'textAlign': 'center'}),
+                            dcc.Store(id = 'mc_job'),
+                            dcc.Interval(id = 'mc_poll', interval = MC_POLL_INTERVAL, disabled = True),
+                        ],
+                        lg = 5,
+                        xs = 12,
+                    ),
+                ]
+            ),
+            html.Br(),
+            input_row,
+            mc_input_row,
+        ]
+    else:
+        body = [
+            html.Div(bar),
+            html.Br(),
+            input_row,
         ]
+
+    header = [
+        html.H1(
+            strategy_name(index),
+            style= {
+                'textAlign': 'center',
+            }
+        ),
+    ]
+    if index != 0:
+        header.append(
+            dbc.Button('Remove', id = {'type': 'remove_strategy', 'index': index}, color = 'secondary', size = 'sm')
+        )
+
+    return dbc.Card(
+        [
+            dbc.CardBody(
+                header + [
+                    html.Div(
+                        body,
+                        style = {
+                            'display' : 'flex',
+                            'flex-direction': 'column',
+                        },
+                    ),
+                ]
+            )
+        ],
+        id = {'type': 'strategy_card', 'index': index},
     )
 
-bar_card = dbc.Card(
+strategy_cards = html.Div(
+    [strategy_card(index, values) for index, values in enumerate(STRATEGY_DEFAULTS)],
+    id = 'strategy_cards',
+)
+
+### merged bar card to compare all the strategies
+merged_bar_card = dbc.Card(
     [
-        # dbc.CardHeader("Testing header"),
         dbc.CardBody(
             [
-                html.H1(
-                    'Returns A',
-                    style= {
-                        'textAlign': 'center',
-                    }
-                ),
-                html.Div(
-                    [
-                        html.Div(
-                            [
-                                dcc.Graph(
-                                    id = 'cpd_bar',
-                                    figure = {}
-                                ),
-                            ]
-                        ),
-                        html.Br(),
-                        input_label_row,
-                    ],
-                    style = {
-                        'display' : 'flex',
-                        'flex-direction': 'column',
-                    },
-                ),
+                dcc.Graph(id = 'merged_bar', figure = {}),
+                dbc.Button('Add strategy', id = 'add_strategy', n_clicks = 0, color = 'primary'),
             ]
         )
     ]
 )
 
-
-
-### row of inputs for second bar chart
-input_label_row2 = dbc.Row(
+### sweep card: final amount of Returns A over a grid of 2 parameters
+sweep_input_row = dbc.Row(
         [
-            create_label_input_col(principal_label, principal_input2),
-            create_label_input_col(rate_label, rate_input2),
-            create_label_input_col(time_label, time_input2),
-            create_label_input_col(n_label, n_input2),
-
-            create_label_input_col(con_label, con_input2),
-            create_label_input_col(type_con_label, type_con_input2),
-            create_label_input_col(start_con_label, start_con_input2),
-            create_label_input_col(stop_con_label, stop_con_input2),
+            create_label_input_col(sweep_x_label, sweep_x_input),
+            create_label_input_col(sweep_x_range_label, sweep_x_range_input),
+            create_label_input_col(sweep_y_label, sweep_y_input),
+            create_label_input_col(sweep_y_range_label, sweep_y_range_input),
+            create_label_input_col(sweep_steps_label, sweep_steps_input),
         ]
     )
-bar_card2 = dbc.Card(
+sweep_card = dbc.Card(
     [
-        dbc.CardHeader("Testing header"),
         dbc.CardBody(
             [
                 html.H1(
-                    'Returns B',
+                    'Sweep of Returns A',
                     style= {
                         'textAlign': 'center',
                     }
                 ),
-                html.Div(
-                    [
-                        html.Div(
-                            [
-                                dcc.Graph(
-                                    id = 'cpd_bar2',
-                                    figure = {}
-                                ),
-                            ]
-                        ),
-                        html.Br(),
-                        input_label_row2,
-                    ],
-                    style = {
-                        'display' : 'flex',
-                        'flex-direction': 'column',
-                    },
-                ),
+                dcc.Graph(id = 'sweep_heatmap', figure = {}),
+                html.Br(),
+                sweep_input_row,
             ]
         )
     ]
 )
 
-### merged bar card to compare the 2 bar charts
-merged_bar_card = dbc.Card(
+### goal seek card: what strategy A needs to reach a target amount
+goal_input_row = dbc.Row(
+        [
+            create_label_input_col(goal_target_label, goal_target_input),
+            create_label_input_col(goal_solve_for_label, goal_solve_for_input),
+        ]
+    )
+goal_card = dbc.Card(
     [
         dbc.CardBody(
             [
-                dcc.Graph(id = 'merged_bar', figure = {}),
+                html.H1(
+                    'Goal seek for Returns A',
+                    style= {
+                        'textAlign': 'center',
+                    }
+                ),
+                html.H3(id = 'goal_result', style = {'textAlign': 'center'}),
+                html.Br(),
+                goal_input_row,
             ]
         )
     ]
@@ -719,7 +1123,7 @@ info_card = dbc.Card(
         dbc.CardBody(
             [
                 dcc.Markdown("""
-                This is a dashboard hosted on Heroku to visualize compounding over time and comparing returns between 2 different "investing" strategies. A simple example has been set as the default values to explain the different inputs.
+                This is a dashboard hosted on Heroku to visualize compounding over time and comparing returns between different "investing" strategies (2 to start with, "Add strategy" adds more). A simple example has been set as the default values to explain the different inputs.
 
                 #### Example: Mary vs John, and the importance of investing early.
                 *Note: This was adapted from a chapter in the book: Show Me the Money by Teh Hooi Ling.*
@@ -779,10 +1183,12 @@ layout = dbc.Container(
 
         ### main components
         info_card,
-        bar_card,
-        bar_card2,
+        strategy_cards,
         merged_bar_card,
+        sweep_card,
+        goal_card,
         html.Br(),
+        dcc.Store(id = 'figure_skeletons', data = figure_skeletons() if CLIENTSIDE else None),
 
 
 
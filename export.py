@@ -0,0 +1,261 @@
+"""
+Streaming export of simulation results, served at EXPORT_PATH (see install).
+
+    GET  /export?p=0&r=0.1&t=65&con=2000&type_con=1&start_con=19&stop_con=25&n=1
+        one scenario, the cpd_interest_v4_2 table
+    GET  /export?<the 8 parameters>&sweep_x=start_con&sweep_x_min=1&sweep_x_max=60&sweep_y=r&sweep_y_min=0.01&sweep_y_max=0.15&steps=100
+        every scenario of a sweep (as in the dashboard), with a Scenario column
+    POST /export  with a CSV, or JSON lines, of scenarios (one column per parameter)
+        every scenario in the body, with a Scenario column
+
+format=csv (default) or format=parquet (needs pyarrow). The table is generated and sent at most EXPORT_BLOCK_ROWS rows
+at a time (whole scenarios through cpd_interest_batch, or a range of periods of a longer one), so no export is ever
+held in memory whole.
+"""
+import io
+
+import flask
+import numpy as np
+import pandas as pd
+
+from simulation import (
+    CPD_COLUMNS, INTEGER_PARAMS, PARAM_NAMES, batch_params, cpd_interest_batch, cpd_result_cached, sweep_values,
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_PATH = '/export'
+
+### rows generated (and sent) at a time
+EXPORT_BLOCK_ROWS = 100_000
+
+### most scenarios a single export runs
+EXPORT_MAX_SCENARIOS = 1_000_000
+
+### most values per axis of a sweep (EXPORT_MAX_STEPS ** 2 = EXPORT_MAX_SCENARIOS)
+EXPORT_MAX_STEPS = 1_000
+
+### most periods (t * n) of a scenario. A long scenario is simulated whole before it's sent in blocks
+EXPORT_MAX_PERIODS = 1_000_000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+### blocks of the table
+def result_blocks(result, block_rows = EXPORT_BLOCK_ROWS):
+    """
+    A CpdResult's table, block_rows periods at a time.
+    """
+    for start in range(0, max(len(result), 1), block_rows):
+        rows = np.arange(start, min(start + block_rows, len(result)))
+        yield result.to_frame(rows = rows).drop(columns = 'Amount_Marker')
+
+
+def single_blocks(parameters, block_rows = EXPORT_BLOCK_ROWS):
+    return result_blocks(cpd_result_cached(*parameters), block_rows)
+
+
+def batch_blocks(params, block_rows = EXPORT_BLOCK_ROWS):
+    """
+    Scenarios of up to block_rows periods go through cpd_interest_batch, as many whole scenarios per block as fit in
+    block_rows periods of the longest of them. Longer scenarios are run alone and sent block_rows periods at a time.
+    """
+    params = batch_params(params)
+    periods = np.rint(params['t'] * params['n']).astype(np.int64)
+    long = periods > block_rows
+    scenarios = max(1, block_rows // max(int(periods[~long].max(initial = 0)), 1))
+    if not len(periods):
+        yield pd.DataFrame(columns = ['Scenario'] + CPD_COLUMNS)
+
+    start = 0
+    while start < len(periods):
+        if long[start]:
+            scenario = {name: array[start:start + 1] for name, array in params.items()}
+            for df in result_blocks(cpd_interest_batch(scenario).result(0), block_rows):
+                df.insert(0, 'Scenario', start)
+                yield df
+            start += 1
+            continue
+        # up to the next long scenario
+        end = min(start + scenarios, len(periods))
+        end = start + int(np.argmax(long[start:end])) if long[start:end].any() else end
+        chunk = {name: array[start:end] for name, array in params.items()}
+        yield cpd_interest_batch(chunk).long_frame(first_scenario = start)
+        start = end
+
+
+### encoders
+def csv_stream(blocks):
+    header = True
+    for df in blocks:
+        yield df.to_csv(index = False, header = header).encode()
+        header = False
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    Write-only file that keeps what was written until take() is called, for writers that want a file.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_stream(blocks):
+    # one row group per block
+    sink = ChunkSink()
+    writer = None
+    for df in blocks:
+        table = pyarrow.Table.from_pandas(df, preserve_index = False)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+        writer.write_table(table.cast(writer.schema))
+        yield sink.take()
+    if writer is not None:
+        writer.close()
+    yield sink.take()
+
+
+STREAMS = {
+    'csv': csv_stream,
+    'parquet': parquet_stream,
+}
+
+
+### request parsing
+def query_parameters(args):
+    """
+    The 8 parameters from the query string, as cpd_interest_v4_2 takes them.
+    """
+    parameters = []
+    for name in PARAM_NAMES:
+        if name not in args:
+            raise ValueError('missing parameter {!r}'.format(name))
+        value = float(args[name])
+        parameters.append(int(value) if name in INTEGER_PARAMS and np.isfinite(value) else value)
+    return parameters
+
+
+def sweep_params(args, parameters):
+    """
+    Scenarios of a sweep: the grid of sweep_x x sweep_y values, the other parameters fixed.
+    """
+    x_name, y_name = args['sweep_x'], args.get('sweep_y')
+    steps = int(args.get('steps', 100))
+    if not 1 <= steps <= EXPORT_MAX_STEPS:
+        raise ValueError('steps must be between 1 and {:,}'.format(EXPORT_MAX_STEPS))
+    params = dict(zip(PARAM_NAMES, parameters))
+    x_values = sweep_values(x_name, float(args['sweep_x_min']), float(args['sweep_x_max']), steps)
+    if y_name is None:
+        params[x_name] = x_values
+        return params
+    if x_name == y_name:
+        raise ValueError('sweep needs two different parameters, got {!r} twice'.format(x_name))
+    y_values = sweep_values(y_name, float(args['sweep_y_min']), float(args['sweep_y_max']), steps)
+    check_scenarios(len(x_values) * len(y_values))
+    x_grid, y_grid = np.meshgrid(x_values, y_values)
+    params[x_name] = x_grid.ravel()
+    params[y_name] = y_grid.ravel()
+    return params
+
+
+def body_params(request):
+    """
+    Scenarios from the request body: CSV, or JSON lines when the content type says json.
+    """
+    body = io.BytesIO(request.get_data())
+    if 'json' in (request.mimetype or ''):
+        return pd.read_json(body, lines = True)
+    return pd.read_csv(body)
+
+
+def check_scenarios(scenarios):
+    if scenarios > EXPORT_MAX_SCENARIOS:
+        raise ValueError('at most {:,} scenarios per export'.format(EXPORT_MAX_SCENARIOS))
+
+
+def check_params(params):
+    """
+    Raises ValueError unless every scenario of params (as from batch_params) can be simulated, before anything
+    the size of the table is allocated.
+    """
+    check_scenarios(len(params['p']))
+    if not np.all(params['n'] > 0):
+        raise ValueError('n must be positive')
+    if not np.all(params['type_con'] >= 1):
+        raise ValueError('type_con must be at least 1')
+    periods = params['t'] * params['n']
+    if not np.all((periods >= 0) & (periods <= EXPORT_MAX_PERIODS)):
+        raise ValueError('t * n must be between 0 and {:,}'.format(EXPORT_MAX_PERIODS))
+
+
+def export_blocks(request):
+    """
+    (number of scenarios, generator of the table's blocks) for an export request.
+    Raises ValueError for parameters that can't be exported.
+    """
+    if request.method == 'POST':
+        params = batch_params(body_params(request))
+    else:
+        parameters = query_parameters(request.args)
+        if 'sweep_x' not in request.args:
+            check_params(batch_params(dict(zip(PARAM_NAMES, parameters))))
+            return 1, single_blocks(parameters)
+        params = batch_params(sweep_params(request.args, parameters))
+    check_params(params)
+    return len(params['p']), batch_blocks(params)
+
+
+def install(server):
+    """
+    Adds the export endpoint to a Flask server.
+    """
+    @server.route(EXPORT_PATH, methods = ['GET', 'POST'])
+    def export():
+        request = flask.request
+        file_format = request.args.get('format', 'csv')
+        if file_format not in FORMATS:
+            return flask.Response('format must be one of {}'.format(list(FORMATS)), status = 400)
+        if file_format == 'parquet' and pyarrow is None:
+            return flask.Response('parquet export needs pyarrow', status = 400)
+        try:
+            _, blocks = export_blocks(request)
+        except (KeyError, ValueError, TypeError, ArithmeticError) as error:
+            return flask.Response('bad export request: {}'.format(error), status = 400)
+
+        response = flask.Response(
+            flask.stream_with_context(STREAMS[file_format](blocks)),
+            mimetype = FORMATS[file_format],
+            headers = {
+                'Content-Disposition': 'attachment; filename=simulation.{}'.format(file_format),
+                # keeps Flask-Compress from reading the whole stream to compress it
+                'Content-Encoding': 'identity',
+            },
+        )
+        return response
+
+    return server
@@ -0,0 +1,52 @@
+"""
+Faster JSON encoding for Dash responses.
+
+Dash serializes every callback response with plotly.utils.PlotlyJSONEncoder, which walks numpy arrays
+element by element and, whenever the output contains NaN, decodes and re-encodes the whole string.
+FastPlotlyJSONEncoder hands the response to orjson instead, which writes float64 arrays in one pass
+(NaN / inf become null, same as plotly). Anything orjson can't handle goes through plotly's own default(),
+and if orjson isn't installed the encoder is plotly's.
+
+The bundled plotly.js (1.58) predates typed-array (base64) figure data, so arrays are still sent as JSON lists.
+"""
+import os
+
+import numpy as np
+import plotly
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENABLED = orjson is not None and os.environ.get('CPD_FAST_JSON', '1').lower() not in ('0', 'false', 'no')
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+class FastPlotlyJSONEncoder(plotly.utils.PlotlyJSONEncoder):
+    def encode(self, o):
+        if orjson is None:
+            return super().encode(o)
+        try:
+            return orjson.dumps(o, default = self.fast_default, option = ORJSON_OPTIONS).decode()
+        except TypeError:
+            return super().encode(o)
+
+    def fast_default(self, obj):
+        # arrays orjson doesn't take natively (object dtype, non contiguous, ...)
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        return self.default(obj)
+
+
+def dumps(obj):
+    return FastPlotlyJSONEncoder().encode(obj)
+
+
+def install():
+    """
+    Makes Dash use FastPlotlyJSONEncoder. Dash looks plotly.utils.PlotlyJSONEncoder up every time it serializes.
+    """
+    plotly.utils.PlotlyJSONEncoder = FastPlotlyJSONEncoder
@@ -0,0 +1,114 @@
+"""
+Goal seek: the value of one parameter of cpd_interest_v4_2 that gets the final Amount to a target.
+
+Every candidate is evaluated with final_amount_batch (closed form, no per-period arrays), many at a time:
+    con: the final amount is linear in con, so two evaluations and the annuity inverse give it exactly
+    r: bracketed root finding, GOAL_SEEK_POINTS rates per evaluation, narrowing to the bracket that crosses the target
+    start_con, t: whole numbers, every candidate is evaluated in one go
+"""
+import numpy as np
+
+from simulation import PARAM_NAMES, final_amount_batch
+
+SOLVE_FOR = ['con', 'r', 'start_con', 't']
+
+### candidates per final_amount_batch call when solving for r, and the annual rates searched
+GOAL_SEEK_POINTS = 64
+RATE_BRACKET = (-0.99, 10.0)
+RATE_TOLERANCE = 1e-12
+MAX_RATE_ROUNDS = 10
+
+### longest horizon (years) tried when solving for t
+MAX_YEARS = 200
+
+
+def final_amounts(base, name, values):
+    params = dict(base)
+    params[name] = np.asarray(values, dtype = float)
+    return final_amount_batch(params)
+
+
+def solve_con(target, base):
+    """
+    Contribution that reaches target: final = F(con = 0) + con * (F(con = 1) - F(con = 0)).
+    Raises ValueError if it would have to be negative, ie the target is already reached without contributing.
+    """
+    without, with_one = final_amounts(base, 'con', [0.0, 1.0])
+    annuity = with_one - without
+    if not np.isfinite(annuity) or annuity == 0:
+        raise ValueError('no contributions are made between the start and stop periods')
+    con = (target - without) / annuity
+    if con < 0:
+        raise ValueError('{:,.2f} is reached at any contribution, even 0 ({:,.2f} without any)'.format(target, without))
+    return con
+
+
+def solve_rate(target, base, bracket = RATE_BRACKET, points = GOAL_SEEK_POINTS, tolerance = RATE_TOLERANCE):
+    """
+    Lowest annual rate in bracket that reaches target. Each round evaluates `points` rates and keeps the first
+    interval where the final amount crosses the target, so the bracket shrinks by points - 1 per round.
+    Raises ValueError if the target is already exceeded at the bracket's lowest rate, or reached at none.
+    """
+    lo, hi = bracket
+    for round_ in range(MAX_RATE_ROUNDS):
+        rates = np.linspace(lo, hi, points)
+        gap = final_amounts(base, 'r', rates) - target
+        if round_ == 0 and gap[0] > 0:
+            raise ValueError('{:,.2f} is reached at any rate, even {:.0%}'.format(target, lo))
+        exact = np.nonzero(gap == 0)[0]
+        crossing = np.nonzero(np.sign(gap[:-1]) * np.sign(gap[1:]) < 0)[0]
+        if exact.size and (not crossing.size or exact[0] <= crossing[0]):
+            return rates[exact[0]]
+        if not crossing.size:
+            raise ValueError('no rate between {:.0%} and {:.0%} reaches {:,.2f}'.format(lo, hi, target))
+        i = crossing[0]
+        lo, hi, gap_lo, gap_hi = rates[i], rates[i + 1], gap[i], gap[i + 1]
+        if hi - lo < tolerance:
+            break
+    # linear interpolation inside the last bracket
+    return lo - gap_lo * (hi - lo) / (gap_hi - gap_lo)
+
+
+def solve_start_con(target, base):
+    """
+    Latest period contributions can start at and still reach target.
+    """
+    periods = int(base['t'] * base['n'])
+    candidates = np.arange(1, periods + 1)
+    reached = final_amounts(base, 'start_con', candidates) >= target
+    if not reached.any():
+        raise ValueError('target {:,.2f} is not reached even when contributing from period 1'.format(target))
+    return int(candidates[reached].max())
+
+
+def solve_time(target, base, max_years = MAX_YEARS):
+    """
+    Fewest years after which the amount reaches target.
+    """
+    candidates = np.arange(1, max_years + 1)
+    reached = final_amounts(base, 't', candidates) >= target
+    if not reached.any():
+        raise ValueError('target {:,.2f} is not reached within {} years'.format(target, max_years))
+    return int(candidates[reached].min())
+
+
+SOLVERS = {
+    'con': solve_con,
+    'r': solve_rate,
+    'start_con': solve_start_con,
+    't': solve_time,
+}
+
+
+def goal_seek(target, solve_for, p, r, t, con, type_con, start_con, stop_con, n):
+    """
+    target: final Amount to reach
+    solve_for: one of SOLVE_FOR. Its value in the other parameters is ignored
+    p, r, t, con, type_con, start_con, stop_con, n: as in cpd_interest_v4_2
+
+    return: the value of solve_for. Raises ValueError if no value reaches the target
+    """
+    if solve_for not in SOLVERS:
+        raise ValueError('solve_for must be one of {}, got {!r}'.format(SOLVE_FOR, solve_for))
+    base = dict(zip(PARAM_NAMES, (p, r, t, con, type_con, start_con, stop_con, n)))
+    return SOLVERS[solve_for](target, base)
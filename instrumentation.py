@@ -0,0 +1,235 @@
+"""
+Opt-in request instrumentation for the Dash server. CPD_INSTRUMENT=1 turns it on (see install).
+
+Each request records how long it spent per stage:
+    simulate, build_figure: marked in the callbacks with `with timed(...)`
+    serialize: the PlotlyJSONEncoder pass Dash runs on every callback response
+    compress: Flask-Compress' after_request
+    total: whole request
+They are sent back in a Server-Timing header and aggregated into per-callback histograms at /_metrics.
+
+CPD_PROFILE_SLOW_MS=<ms> also samples the stack of every request and, for requests slower than that, writes the
+samples in folded format (one `frame;frame;frame count` line per stack, what flamegraph.pl / speedscope read)
+to CPD_PROFILE_DIR.
+"""
+import collections
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import flask
+import plotly
+
+ENABLED = os.environ.get('CPD_INSTRUMENT', '').lower() in ('1', 'true', 'yes')
+PROFILE_SLOW_MS = float(os.environ.get('CPD_PROFILE_SLOW_MS', 0)) or None
+PROFILE_DIR = os.environ.get('CPD_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'compounding-profiles'))
+PROFILE_INTERVAL_MS = float(os.environ.get('CPD_PROFILE_INTERVAL_MS', 5))
+
+METRICS_PATH = '/_metrics'
+
+### histogram bucket upper bounds, in ms
+BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, float('inf')]
+
+STAGES = ['simulate', 'build_figure', 'serialize', 'compress', 'total']
+
+_installed = False
+
+
+@contextlib.contextmanager
+def timed(stage):
+    """
+    Adds the time spent in the block to `stage` of the current request. Does nothing unless installed.
+    """
+    if not _installed or not flask.has_request_context():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(stage, time.perf_counter() - start)
+
+
+def add_timing(stage, seconds):
+    timings = flask.g.setdefault('cpd_timings', collections.defaultdict(float))
+    timings[stage] += seconds * 1000
+
+
+class Histogram:
+    def __init__(self, buckets = BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def to_dict(self):
+        # cumulative counts per upper bound, like prometheus' le buckets
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets['+Inf' if bound == float('inf') else str(bound)] = cumulative
+        return {'count': self.count, 'sum_ms': round(self.sum, 3), 'buckets': buckets}
+
+
+class Metrics:
+    """
+    Histogram per (callback, stage). In-process: every gunicorn worker keeps its own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = collections.defaultdict(Histogram)
+        # set by wsgi.py: how long this process took to import and warm up
+        self.startup = None
+
+    def observe(self, callback, timings):
+        with self._lock:
+            for stage, ms in timings.items():
+                self._histograms[(callback, stage)].observe(ms)
+
+    def snapshot(self):
+        with self._lock:
+            out = collections.defaultdict(dict)
+            for (callback, stage), histogram in self._histograms.items():
+                out[callback][stage] = histogram.to_dict()
+        return {'pid': os.getpid(), 'startup': self.startup, 'callbacks': out}
+
+
+metrics = Metrics()
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stack of one thread every interval seconds until stopped and counts the folded stacks.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon = True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+def write_folded(stacks, label, total_ms, profile_dir = PROFILE_DIR):
+    os.makedirs(profile_dir, exist_ok = True)
+    name = '{}-{:.0f}ms-{}.folded'.format(time.strftime('%Y%m%d-%H%M%S'), total_ms, ''.join(c if c.isalnum() else '_' for c in label)[:80])
+    path = os.path.join(profile_dir, name)
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write('{} {}\n'.format(stack, count))
+    return path
+
+
+def timed_encoder(encoder):
+    """
+    Subclass of a json encoder class that records its encode() calls as the serialize stage.
+    """
+    class TimedEncoder(encoder):
+        def encode(self, o):
+            with timed('serialize'):
+                return super().encode(o)
+    return TimedEncoder
+
+
+def callback_label():
+    """
+    Dash callbacks all go through one url, name them by their outputs instead.
+    """
+    request = flask.request
+    if request.path.endswith('_dash-update-component'):
+        body = request.get_json(silent = True) or {}
+        return body.get('output', request.path)
+    return request.path
+
+
+def server_timing_header(timings):
+    return ', '.join('{};dur={:.2f}'.format(stage, ms) for stage, ms in timings.items())
+
+
+def install(app, profile_slow_ms = PROFILE_SLOW_MS, profile_dir = PROFILE_DIR, profile_interval_ms = PROFILE_INTERVAL_MS):
+    """
+    Hooks the instrumentation into a Dash app's Flask server and adds the /_metrics endpoint.
+    """
+    global _installed
+    server = app.server
+
+    # dash looks the encoder up on plotly.utils each time it serializes a callback response.
+    # Wraps whichever encoder is installed at this point (eg fast_json's)
+    plotly.utils.PlotlyJSONEncoder = timed_encoder(plotly.utils.PlotlyJSONEncoder)
+
+    @server.before_request
+    def start_request():
+        flask.g.cpd_start = time.perf_counter()
+        flask.g.cpd_timings = collections.defaultdict(float)
+        if profile_slow_ms:
+            flask.g.cpd_sampler = StackSampler(threading.get_ident(), profile_interval_ms / 1000)
+            flask.g.cpd_sampler.start()
+
+    # time Flask-Compress' hook, wherever it is in the list
+    after_request_funcs = server.after_request_funcs.setdefault(None, [])
+    for i, func in enumerate(after_request_funcs):
+        if type(getattr(func, '__self__', None)).__name__ == 'Compress':
+            def timed_compress(response, compress = func):
+                with timed('compress'):
+                    return compress(response)
+            after_request_funcs[i] = timed_compress
+
+    def finish_request(response):
+        start = flask.g.get('cpd_start')
+        if start is None:
+            return response
+        timings = flask.g.cpd_timings
+        timings['total'] = (time.perf_counter() - start) * 1000
+        response.headers['Server-Timing'] = server_timing_header(timings)
+
+        label = callback_label()
+        if flask.request.path != METRICS_PATH:
+            metrics.observe(label, timings)
+
+        sampler = flask.g.get('cpd_sampler')
+        if sampler is not None:
+            stacks = sampler.stop()
+            if timings['total'] >= profile_slow_ms and stacks:
+                write_folded(stacks, label, timings['total'], profile_dir)
+        return response
+
+    # after_request functions run in reverse order, so the first one in the list runs last (after compression)
+    after_request_funcs.insert(0, finish_request)
+
+    @server.route(METRICS_PATH)
+    def metrics_endpoint():
+        return flask.Response(json.dumps(metrics.snapshot()), mimetype = 'application/json')
+
+    _installed = True
+    return server
@@ -0,0 +1,273 @@
+"""
+Background jobs for simulations that are too slow to run inside a request (big sweeps, big Monte Carlo runs).
+
+A job is a list of independent tasks run on a shared ProcessPoolExecutor, plus a combine function that turns
+their results into one. Job status and results are written to JOB_DIR, so with several gunicorn workers a
+poll that lands on a different worker than the one that submitted the job still finds it.
+"""
+import functools
+import json
+import multiprocessing
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from montecarlo import MC_MAX_RECORDED, combine_shards, monte_carlo_shard, shard_args
+from simulation import batch_params, cpd_interest_batch
+
+JOB_DIR = os.environ.get('CPD_JOB_DIR', os.path.join(tempfile.gettempdir(), 'compounding-jobs'))
+
+### finished jobs are deleted from JOB_DIR after this many seconds
+JOB_TTL = 60 * 60
+
+### scenarios per task when a batch is split across processes
+BATCH_TASK_ROWS = 10_000
+
+### the pool's processes are started by a fork server: forking the web worker itself (gthread, so multi-threaded) could
+### copy locks held by its other threads into the children
+MP_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+### what submit() hands out. Ids come back from the browser, anything else is rejected before it gets near a path
+JOB_ID_PATTERN = re.compile('[0-9a-f]{32}')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def run_task(status_path, function, args):
+    """
+    Runs one task of a job in a pool process, unless the job was cancelled (by any process) before it started.
+    """
+    try:
+        with open(status_path) as f:
+            cancelled = json.load(f)['state'] == 'cancelled'
+    except (OSError, ValueError, KeyError):
+        cancelled = False
+    if cancelled:
+        raise JobCancelled(status_path)
+    return function(*args)
+
+
+class JobManager:
+    """
+    max_workers: size of the process pool. Defaults to the number of cores
+    job_dir: where job status / results are kept
+    """
+
+    def __init__(self, max_workers = None, job_dir = JOB_DIR):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.job_dir = job_dir
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pid = None
+        # futures of the jobs this process submitted, so cancel() can drop the ones that haven't started
+        self._futures = {}
+
+    @property
+    def executor(self):
+        # created on first use, and again after a fork: a pool can't be shared between processes
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                context = multiprocessing.get_context(MP_START_METHOD)
+                if MP_START_METHOD == 'forkserver':
+                    # imported once in the fork server, not by every pool process
+                    context.set_forkserver_preload(['jobs'])
+                self._executor = ProcessPoolExecutor(max_workers = self.max_workers, mp_context = context)
+                self._pid = os.getpid()
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait = False, cancel_futures = True)
+            self._executor = None
+
+    def _path(self, job_id, ext):
+        if not isinstance(job_id, str) or not JOB_ID_PATTERN.fullmatch(job_id):
+            raise ValueError('not a job id: {!r}'.format(job_id))
+        return os.path.join(self.job_dir, '{}.{}'.format(job_id, ext))
+
+    def _write(self, job_id, ext, write):
+        os.makedirs(self.job_dir, exist_ok = True)
+        fd, tmp = tempfile.mkstemp(dir = self.job_dir, suffix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp, self._path(job_id, ext))
+
+    def _write_status(self, job_id, status):
+        self._write(job_id, 'json', lambda f: f.write(json.dumps(status).encode()))
+
+    def submit(self, tasks, combine = None):
+        """
+        tasks: list of (function, args) tuples. Functions must be importable top level functions (they are pickled)
+        combine: function of the list of task results (in task order). Defaults to returning the list
+
+        return: job id
+        """
+        self.cleanup()
+        job_id = uuid.uuid4().hex
+        total = len(tasks)
+        status = {'state': 'running', 'done': 0, 'total': total, 'error': None, 'started': time.time()}
+        self._write_status(job_id, status)
+
+        results = [None] * total
+        lock = threading.Lock()
+
+        def finish(error = None):
+            if error is None:
+                try:
+                    result = combine(results) if combine else results
+                    self._write(job_id, 'pkl', lambda f: pickle.dump(result, f, protocol = pickle.HIGHEST_PROTOCOL))
+                    status['state'] = 'done'
+                except Exception:
+                    error = traceback.format_exc()
+            if error is not None:
+                status['state'] = 'failed'
+                status['error'] = error
+            status['finished'] = time.time()
+            self._write_status(job_id, status)
+            self._futures.pop(job_id, None)
+
+        def on_done(index, future):
+            with lock:
+                if status['state'] != 'running':
+                    return
+                if future.cancelled() or isinstance(future.exception(), JobCancelled) or self.status(job_id)['state'] == 'cancelled':
+                    status['state'] = 'cancelled'
+                    self._futures.pop(job_id, None)
+                    return
+                error = future.exception()
+                if error is not None:
+                    return finish(''.join(traceback.format_exception(type(error), error, error.__traceback__)))
+                results[index] = future.result()
+                status['done'] += 1
+                if status['done'] == total:
+                    return finish()
+                self._write_status(job_id, status)
+
+        if not tasks:
+            finish()
+        status_path = self._path(job_id, 'json')
+        futures = self._futures[job_id] = []
+        for index, (function, args) in enumerate(tasks):
+            future = self.executor.submit(run_task, status_path, function, args)
+            futures.append(future)
+            future.add_done_callback(lambda future, index = index: on_done(index, future))
+        return job_id
+
+    def cancel(self, job_id):
+        """
+        Stops a running job: tasks that haven't started are dropped (in any process, they check the job's status
+        first), the ones already running finish but their results are discarded. Does nothing to finished jobs.
+        """
+        status = self.status(job_id)
+        if status['state'] != 'running':
+            return False
+        status['state'] = 'cancelled'
+        status['finished'] = time.time()
+        self._write_status(job_id, status)
+        for future in self._futures.pop(job_id, []):
+            future.cancel()
+        return True
+
+    def status(self, job_id):
+        """
+        return: dict with state ('running', 'done', 'failed', 'cancelled' or 'unknown'), done and total task counts, error.
+        An id that isn't one submit() could have returned is 'unknown'
+        """
+        try:
+            with open(self._path(job_id, 'json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'state': 'unknown', 'done': 0, 'total': 0, 'error': None}
+
+    def progress(self, job_id):
+        status = self.status(job_id)
+        return status['done'] / status['total'] if status['total'] else float(status['state'] == 'done')
+
+    def result(self, job_id):
+        """
+        Result of a finished job. Raises RuntimeError if the job failed, is still running or doesn't exist.
+        """
+        status = self.status(job_id)
+        if status['state'] != 'done':
+            raise RuntimeError('job {} is {}{}'.format(job_id, status['state'], ': ' + status['error'] if status['error'] else ''))
+        with open(self._path(job_id, 'pkl'), 'rb') as f:
+            return pickle.load(f)
+
+    def wait(self, job_id, timeout = None, poll = 0.1):
+        deadline = None if timeout is None else time.time() + timeout
+        while self.status(job_id)['state'] == 'running':
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError('job {} still running after {}s'.format(job_id, timeout))
+            time.sleep(poll)
+        return self.result(job_id)
+
+    def cleanup(self, ttl = JOB_TTL):
+        """
+        Deletes files of jobs older than ttl seconds.
+        """
+        if not os.path.isdir(self.job_dir):
+            return
+        cutoff = time.time() - ttl
+        for name in os.listdir(self.job_dir):
+            path = os.path.join(self.job_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+### one pool per process, shared by every request that process serves. With several gunicorn workers set
+### CPD_JOB_WORKERS so that workers x pool size doesn't oversubscribe the cores
+job_manager = JobManager(max_workers = int(os.environ.get('CPD_JOB_WORKERS', 0)) or None)
+
+
+### batch jobs
+def batch_summary_task(params):
+    return cpd_interest_batch(params).summary()
+
+
+def submit_batch(params, rows_per_task = BATCH_TASK_ROWS, manager = None):
+    """
+    cpd_interest_batch(params).summary() split across the process pool, rows_per_task scenarios per task.
+    The job's result is the summary DataFrame, in the same order as params.
+    """
+    manager = manager or job_manager
+    params = batch_params(params)
+    rows = len(params['p'])
+    tasks = [
+        (batch_summary_task, ({name: array[start:start + rows_per_task] for name, array in params.items()},))
+        for start in range(0, rows, rows_per_task)
+    ]
+    return manager.submit(tasks, combine = lambda frames: pd.concat(frames, ignore_index = True))
+
+
+### monte carlo jobs
+def submit_monte_carlo(p, r, t, con, type_con, start_con, stop_con, n, sigma, paths = 10_000, seed = 0,
+                       distribution = 'lognormal', percentiles = (5, 50, 95), shards = None,
+                       chunk_size = None, max_recorded = MC_MAX_RECORDED, manager = None):
+    """
+    montecarlo.monte_carlo as a background job, one task per shard. The job's result is a MonteCarloResult,
+    identical to monte_carlo(...) with the same seed and shards.
+    """
+    manager = manager or job_manager
+    if shards is None:
+        # a few shards per worker so progress moves in small steps
+        shards = 4 * manager.max_workers
+    args = shard_args(p, r, t, con, type_con, start_con, stop_con, n, sigma, paths, seed, distribution, chunk_size,
+                      max_recorded, shards)
+    return manager.submit(
+        [(monte_carlo_shard, shard) for shard in args],
+        combine = functools.partial(combine_shards, periods = t * n, paths = paths, percentiles = percentiles, max_recorded = max_recorded),
+    )
@@ -0,0 +1,205 @@
+"""
+Monte Carlo version of cpd_interest_v4_2: every period's return is drawn at random instead of being a constant r/n.
+
+Paths are simulated chunk by chunk and each chunk is folded into a QuantileSketch (one histogram per period),
+so memory depends on MC_CHUNK_CELLS and the number of periods, not on the number of paths.
+"""
+import numpy as np
+
+from simulation import contribution_vector
+
+### paths x periods simulated at once (floats), a few temporaries of that size are alive at a time.
+### Chunks hold MC_CHUNK_CELLS // periods paths, so daily compounding over decades doesn't blow up memory
+MC_CHUNK_CELLS = 2_000_000
+
+DISTRIBUTIONS = ['lognormal', 'normal']
+
+### at most this many periods are tracked in the sketch (evenly spaced, always including the last one).
+### Keeps the sketch at a few MB even for daily compounding over decades
+MC_MAX_RECORDED = 800
+
+
+class QuantileSketch:
+    """
+    Mergeable fixed-bin histogram per period, for streaming quantiles.
+
+    Values are binned on asinh(value / scale): that is close to log for large amounts (so the error is relative,
+    about bin_width / 2) and still handles 0 and negative amounts. Values outside the range go into the edge bins.
+    """
+
+    def __init__(self, periods, bin_width = 0.01, limit = 32.0, scale = 1.0):
+        self.periods = periods
+        self.bin_width = bin_width
+        self.limit = limit
+        self.scale = scale
+        self.bins = int(np.ceil(2 * limit / bin_width))
+        self.counts = np.zeros((periods, self.bins), dtype = np.int32)
+        self.total = np.zeros(periods)
+        self.n = 0
+
+    def add(self, values):
+        """
+        values: (paths x periods) array
+        """
+        bin_index = np.floor((np.arcsinh(values / self.scale) + self.limit) / self.bin_width)
+        bin_index = np.clip(bin_index, 0, self.bins - 1).astype(np.int64)
+        flat = bin_index + np.arange(self.periods) * self.bins
+        self.counts += np.bincount(flat.ravel(), minlength = self.periods * self.bins).reshape(self.counts.shape).astype(np.int32)
+        self.total += values.sum(axis = 0)
+        self.n += values.shape[0]
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.total += other.total
+        self.n += other.n
+        return self
+
+    def mean(self):
+        return self.total / self.n
+
+    def quantile(self, q):
+        """
+        q-th quantile (0 <= q <= 1) for every period, interpolated linearly inside the bin it falls in.
+        """
+        cum = np.cumsum(self.counts, axis = 1, dtype = np.int64)
+        target = q * self.n
+        index = np.minimum((cum < target).sum(axis = 1), self.bins - 1)
+        rows = np.arange(self.periods)
+        below = np.where(index > 0, cum[rows, np.maximum(index - 1, 0)], 0)
+        in_bin = self.counts[rows, index]
+        fraction = np.where(in_bin > 0, (target - below) / np.maximum(in_bin, 1), 0.5)
+        edge = -self.limit + (index + np.clip(fraction, 0, 1)) * self.bin_width
+        return np.sinh(edge) * self.scale
+
+
+def period_returns(rng, size, r, sigma, n, distribution = 'lognormal'):
+    """
+    Random per-period returns for annual mean r and annual volatility sigma, compounded n times a year.
+
+    lognormal: log(1 + R) is normal, with its mean picked so that E[1 + R] = 1 + r/n. Returns never go below -100%
+    normal: R itself is normal with mean r/n and std sigma/sqrt(n)
+    """
+    period_sigma = sigma / np.sqrt(n)
+    if distribution == 'lognormal':
+        mu = np.log1p(r / n) - period_sigma ** 2 / 2
+        return np.expm1(rng.normal(mu, period_sigma, size))
+    elif distribution == 'normal':
+        return rng.normal(r / n, period_sigma, size)
+    raise ValueError('distribution must be one of {}, got {!r}'.format(DISTRIBUTIONS, distribution))
+
+
+def simulate_paths(p, contributions, returns):
+    """
+    Amount for each path: amount_i = (amount_{i-1} + contribution_i) * (1 + R_i), unrolled with cumprod and cumsum
+    the same way cpd_interest_np does it for a constant rate.
+    """
+    growth = np.cumprod(1 + returns, axis = 1)
+    prev_growth = np.concatenate((np.ones((returns.shape[0], 1)), growth[:, :-1]), axis = 1)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        amounts = growth * (p + np.cumsum(contributions / prev_growth, axis = 1))
+    # a path that hit -100% stays at 0 plus whatever is contributed afterwards. Redo those rows with the recurrence
+    bad = ~np.isfinite(amounts).all(axis = 1)
+    if bad.any():
+        amount = np.full(bad.sum(), float(p))
+        for i in range(returns.shape[1]):
+            amount = (amount + contributions[i]) * (1 + returns[bad, i])
+            amounts[bad, i] = amount
+    return amounts
+
+
+def recorded_periods(periods, max_recorded = MC_MAX_RECORDED):
+    """
+    0-based indices of the periods that are tracked: evenly spaced, ending on the last period.
+    """
+    step = int(np.ceil(periods / max_recorded)) if periods > max_recorded else 1
+    return np.arange(periods - 1, -1, -step)[::-1]
+
+
+def monte_carlo_shard(p, r, t, con, type_con, start_con, stop_con, n, sigma, paths, seed,
+                      distribution = 'lognormal', chunk_size = None, max_recorded = MC_MAX_RECORDED):
+    """
+    Simulates `paths` paths chunk by chunk and returns them folded into one QuantileSketch.
+    seed: anything np.random.default_rng accepts, eg a SeedSequence from monte_carlo
+    chunk_size: paths per chunk. Defaults to what fits in MC_CHUNK_CELLS
+    """
+    periods = t * n
+    months, contributions = contribution_vector(con, type_con, start_con, stop_con, periods)
+    contributions = contributions.astype(float)
+    record = recorded_periods(periods, max_recorded)
+    sketch = QuantileSketch(len(record))
+    if chunk_size is None:
+        chunk_size = max(1, MC_CHUNK_CELLS // max(periods, 1))
+
+    rng = np.random.default_rng(seed)
+    for start in range(0, paths, chunk_size):
+        size = min(chunk_size, paths - start)
+        returns = period_returns(rng, (size, periods), r, sigma, n, distribution)
+        sketch.add(simulate_paths(p, contributions, returns)[:, record])
+    return sketch
+
+
+class MonteCarloResult:
+    """
+    Per-period percentile bands of a monte_carlo run.
+    months: the (1-based) periods the bands are for
+    bands: dict of percentile (eg 5, 50, 95) to an array with one value per period
+    """
+
+    def __init__(self, months, bands, mean, paths):
+        self.months = months
+        self.bands = bands
+        self.mean = mean
+        self.paths = paths
+
+
+def shard_args(p, r, t, con, type_con, start_con, stop_con, n, sigma, paths, seed, distribution, chunk_size,
+               max_recorded, shards):
+    """
+    Splits a run into `shards` argument tuples for monte_carlo_shard, each with its own child seed.
+    """
+    shards = max(1, min(shards, paths))
+    seeds = np.random.SeedSequence(seed).spawn(shards)
+    shard_paths = [len(part) for part in np.array_split(np.arange(paths), shards)]
+    return [
+        (p, r, t, con, type_con, start_con, stop_con, n, sigma, size, shard_seed, distribution, chunk_size, max_recorded)
+        for size, shard_seed in zip(shard_paths, seeds)
+    ]
+
+
+def combine_shards(sketches, periods, paths, percentiles = (5, 50, 95), max_recorded = MC_MAX_RECORDED):
+    """
+    Merges the sketches of every shard of a run into its MonteCarloResult.
+    """
+    sketch = sketches[0]
+    for other in sketches[1:]:
+        sketch.merge(other)
+
+    bands = {q: sketch.quantile(q / 100) for q in percentiles}
+    return MonteCarloResult(recorded_periods(periods, max_recorded) + 1, bands, sketch.mean(), paths)
+
+
+def monte_carlo(p, r, t, con, type_con, start_con, stop_con, n, sigma, paths = 10_000, seed = 0,
+                distribution = 'lognormal', percentiles = (5, 50, 95), chunk_size = None,
+                executor = None, shards = None, max_recorded = MC_MAX_RECORDED):
+    """
+    p, r, t, con, type_con, start_con, stop_con, n: as in cpd_interest_v4_2, r is the mean annual return
+    sigma: annual volatility of returns (0.15 -> 15%)
+    paths: number of simulated paths
+    seed: seed for the RNG. The same seed and shards give the same result, whether or not an executor is used
+    distribution: 'lognormal' or 'normal', see period_returns
+    executor: optional concurrent.futures executor. Shards are run on it in parallel and their sketches merged
+    shards: number of independent streams the paths are split into. Defaults to 1, or 2 per worker with an executor
+    chunk_size: paths per chunk, see monte_carlo_shard
+    max_recorded: most periods reported, see recorded_periods
+
+    return: MonteCarloResult
+    """
+    if shards is None:
+        shards = 1 if executor is None else 2 * getattr(executor, '_max_workers', 1)
+    args = shard_args(p, r, t, con, type_con, start_con, stop_con, n, sigma, paths, seed, distribution, chunk_size,
+                      max_recorded, shards)
+    if executor is None:
+        sketches = [monte_carlo_shard(*shard) for shard in args]
+    else:
+        sketches = [future.result() for future in [executor.submit(monte_carlo_shard, *shard) for shard in args]]
+    return combine_shards(sketches, t * n, paths, percentiles, max_recorded)
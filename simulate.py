@@ -0,0 +1,141 @@
+"""
+Batch simulation from the command line, without the dashboard (nothing here imports dash or plotly).
+
+    python simulate.py scenarios.csv -o summary.csv
+    python simulate.py scenarios.jsonl -o summary.jsonl --workers 8
+    cat scenarios.csv | python simulate.py - > summary.csv
+
+Input files have one scenario per row (CSV) or line (JSON lines) with the parameters of cpd_interest_v4_2:
+p, r, t, con, type_con, start_con, stop_con, n, plus any other columns (eg an id).
+The output has the input columns as they were, then Final_Amount, Total_Interest and Total_Contribution,
+one row per scenario in input order.
+
+Input is read --rows-per-task scenarios at a time and each block is simulated on a pool of --workers processes,
+at most two blocks per worker in flight, so memory stays bounded whatever the size of the files.
+--engine closed_form (default) computes the summaries directly (summary_batch), --engine batch runs every period
+through cpd_interest_batch first.
+"""
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from jobs import BATCH_TASK_ROWS, batch_summary_task
+from simulation import batch_params, summary_batch
+
+ENGINES = {
+    'closed_form': summary_batch,
+    'batch': batch_summary_task,
+}
+
+FORMATS = ['csv', 'jsonl']
+
+SUMMARY_COLUMNS = ['Final_Amount', 'Total_Interest', 'Total_Contribution']
+
+### blocks queued per worker process, so reading the input keeps ahead of the pool without reading all of it
+TASKS_PER_WORKER = 2
+
+
+def file_format(path, default = 'csv'):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    if extension == '.csv':
+        return 'csv'
+    return default
+
+
+def read_blocks(path, rows_per_task, fmt = None):
+    """
+    DataFrames of up to rows_per_task scenarios from a CSV / JSON lines file ('-' for stdin).
+    """
+    fmt = fmt or file_format(path)
+    source = sys.stdin if path == '-' else path
+    if fmt == 'jsonl':
+        return pd.read_json(source, lines = True, chunksize = rows_per_task)
+    return pd.read_csv(source, chunksize = rows_per_task)
+
+
+def write_block(df, out, fmt, header):
+    if fmt == 'jsonl':
+        text = df.to_json(orient = 'records', lines = True)
+        # older pandas leave out the last newline
+        out.write(text if not text or text.endswith('\n') else text + '\n')
+    else:
+        df.to_csv(out, index = False, header = header)
+
+
+def summarize(block, engine):
+    """
+    One block of scenarios as read (same columns and types) plus their summary columns.
+    """
+    summary = ENGINES[engine](batch_params(block))
+    return pd.concat([block.reset_index(drop = True), summary[SUMMARY_COLUMNS]], axis = 1)
+
+
+def summaries(blocks, engine = 'closed_form', workers = None):
+    """
+    Summaries of every block, in order. workers = 1 runs in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for block in blocks:
+            yield summarize(block, engine)
+        return
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        pending = collections.deque()
+        for block in blocks:
+            pending.append(executor.submit(summarize, block, engine))
+            if len(pending) >= workers * TASKS_PER_WORKER:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run(inputs, output = '-', engine = 'closed_form', workers = None, rows_per_task = BATCH_TASK_ROWS,
+        input_format = None, output_format = None):
+    """
+    Summarizes every scenario of the input files into output ('-' for stdout). Returns the number of scenarios.
+    """
+    output_format = output_format or file_format(output)
+    out = sys.stdout if output == '-' else open(output, 'w', newline = '')
+    rows = 0
+    try:
+        blocks = (block for path in inputs for block in read_blocks(path, rows_per_task, input_format))
+        for df in summaries(blocks, engine, workers):
+            write_block(df, out, output_format, header = rows == 0)
+            rows += len(df)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return rows
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs = '+', help = "CSV / JSON lines parameter files, '-' for stdin")
+    parser.add_argument('-o', '--output', default = '-', help = "output file, stdout by default")
+    parser.add_argument('--engine', choices = list(ENGINES), default = 'closed_form')
+    parser.add_argument('--workers', type = int, default = None, help = 'processes, defaults to the number of cores')
+    parser.add_argument('--rows-per-task', type = int, default = BATCH_TASK_ROWS)
+    parser.add_argument('--input-format', choices = FORMATS, help = 'defaults to the file extension, else csv')
+    parser.add_argument('--output-format', choices = FORMATS, help = 'defaults to the file extension, else csv')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        rows = run(args.inputs, args.output, args.engine, args.workers, args.rows_per_task,
+                   args.input_format, args.output_format)
+    except (KeyError, ValueError) as error:
+        parser.exit(1, 'simulate.py: {}\n'.format(error))
+    elapsed = time.perf_counter() - start
+    print('{:,} scenarios in {:.2f}s ({:,.0f}/s)'.format(rows, elapsed, rows / max(elapsed, 1e-9)), file = sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
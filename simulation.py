@@ -0,0 +1,831 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache, MmapArrayCache
+
+CPD_COLUMNS = ['Month', 'Principal', 'Amount', 'Interest', 'Cumulative_Interest', 'Contribution', 'Cumulative_Contribution']
+
+### which engine cpd_interest_v4_2 uses when none is given. 'loop' is the original per-period implementation, kept as the reference
+DEFAULT_ENGINE = 'numpy'
+
+### results of cpd_result_cached / cpd_interest_cached, keyed on the normalized parameter tuple.
+### CpdResults are read-only and shared as is. DataFrames (loop engine) are copied in and out so callers can't corrupt an entry
+SIMULATION_CACHE_SIZE = 256
+
+
+def copy_cached(value):
+    return value.copy() if isinstance(value, pd.DataFrame) else value
+
+
+simulation_cache = LRUCache(maxsize = SIMULATION_CACHE_SIZE, copy = copy_cached)
+
+### second level behind simulation_cache, shared by every process on the host (gunicorn workers) and kept across
+### restarts: results as raw arrays in CPD_SHARED_CACHE_DIR, read back memory-mapped. CPD_SHARED_CACHE=0 turns it off
+SHARED_CACHE_ENABLED = os.environ.get('CPD_SHARED_CACHE', '1').lower() not in ('0', 'false', 'no')
+SHARED_CACHE_DIR = os.environ.get('CPD_SHARED_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'compounding-cache'))
+SHARED_CACHE_MB = int(os.environ.get('CPD_SHARED_CACHE_MB', 256))
+### entries are tied to this file's source: results computed by an older version of the engines are never served
+with open(__file__, 'rb') as f:
+    SHARED_CACHE_VERSION = hashlib.sha1(f.read()).hexdigest()
+shared_result_cache = MmapArrayCache(
+    SHARED_CACHE_DIR, maxbytes = SHARED_CACHE_MB * 1024 * 1024, version = SHARED_CACHE_VERSION,
+) if SHARED_CACHE_ENABLED else None
+
+### latest result per (p, r, con, type_con, start_con, n), with the t and stop_con it was run for.
+### cpd_result_cached resumes from these when only the horizon or stop_con changed, see resume_result
+checkpoint_cache = LRUCache(maxsize = SIMULATION_CACHE_SIZE)
+
+### growth factor tables g^k and g^(1 - k), k = 1..periods, per growth factor g = 1 + r/n (see growth_table).
+### Shared by every simulation with the same g, whatever r and n gave it. A table over 100 years of daily periods is ~600kB
+GROWTH_TABLE_SIZE = 64
+growth_tables = LRUCache(maxsize = GROWTH_TABLE_SIZE)
+
+### longer tables are computed but not kept, so growth_tables stays under GROWTH_TABLE_SIZE x ~640kB
+GROWTH_TABLE_MAX_PERIODS = 40_000
+
+
+def cpd_interest_v4_2(p, r, t, con, type_con, start_con, stop_con, n, engine = None):
+    """
+    p: principal
+    r: interest rate in decimal (3.75% -> 0.0375)
+    t: time in years (do 1/12 for 1 month)
+    con: contribution made
+    type_con: int, how many times a contribution is made in a year (1 == monthly, 3 == quarterly)
+    start_con: period to start contributions
+    stop_con: months before stopping contributions
+    n: number of times compounded per year (12 for monthly, 365 for daily)
+    engine: 'numpy' or 'loop'. Defaults to DEFAULT_ENGINE
+
+    return: amount = cpd growth of principal + cpd growth of contributions
+    """
+    engine = engine or DEFAULT_ENGINE
+    if engine == 'numpy':
+        return cpd_interest_np(p, r, t, con, type_con, start_con, stop_con, n)
+    elif engine == 'loop':
+        return cpd_interest_loop(p, r, t, con, type_con, start_con, stop_con, n)
+    raise ValueError("engine must be 'numpy' or 'loop', got {!r}".format(engine))
+
+
+def cpd_interest_loop(p, r, t, con, type_con, start_con, stop_con, n):
+    """
+    Original per-period implementation of cpd_interest_v4_2. See cpd_interest_v4_2 for the parameters.
+    """
+    # try and start simple first: basic compounding
+    months = []
+    principals = [p for i in range(1, t*n + 1)]
+
+    amount = p
+    amounts = []
+
+    interest_earned = 0
+    interests = []
+    cum_interest_earned = 0
+    cum_interests = []
+
+    total_contributions = 0
+    contributions = []
+    cum_contributions = []
+    for i in range(1, t * n + 1):
+        months.append(i)
+
+        # check when to contribute
+        if i % type_con != 0 or i < start_con or i > stop_con:
+            amount += 0
+            total_contributions += 0
+            contributions.append(0)
+            cum_contributions.append(total_contributions)
+        else:
+            # print('adding con')
+            amount += con
+            total_contributions += con
+            contributions.append(con)
+            cum_contributions.append(total_contributions)
+
+
+        old_amount = amount
+        amount = amount * (1 + r/n)
+        interest_earned = (amount - old_amount)
+        interests.append(interest_earned)
+        cum_interest_earned += amount - old_amount
+
+        cum_interests.append(cum_interest_earned)
+        # print(amount)
+        amounts.append(amount)
+
+    print("Final Amount: ", amount)
+    print("Total interest earned: ", cum_interest_earned)
+    print("Total contributions: ", total_contributions)
+
+    df = pd.DataFrame(list(zip(months, principals, amounts, interests, cum_interests, contributions, cum_contributions)), columns = CPD_COLUMNS)
+    df = df.round(2)
+
+    ### this creates an empty col of 0s. This allows for you to add an "empty bar" that is able to stack on the bar chart and display the "Amount" in the hover with minimal tinkering.
+    df['Amount_Marker'] = 0
+
+    return df
+
+
+def contribution_vector(con, type_con, start_con, stop_con, periods, first = 1):
+    """
+    Contribution made at the start of each period first..periods, using the same rule as the loop:
+    contribute on every type_con'th period between start_con and stop_con (inclusive).
+    """
+    months = np.arange(first, periods + 1)
+    mask = (months % type_con == 0) & (months >= start_con) & (months <= stop_con)
+    if not mask.any():
+        # the loop only ever appends int 0s here, keep the int dtype to match
+        return months, np.zeros(len(months), dtype = months.dtype)
+    return months, np.where(mask, con, 0)
+
+
+class CpdResult:
+    """
+    One simulation, kept as two arrays (Amount and Contribution per period, not rounded) plus the principal.
+    Every other column of the cpd_interest_v4_2 DataFrame is derived from those when asked for, and to_frame()
+    builds the DataFrame itself. The arrays are read-only so a result can be shared (eg by the cache) without copying.
+    """
+    __slots__ = ('p', 'amount', 'contribution')
+
+    def __init__(self, p, amount, contribution):
+        self.p = p
+        self.amount = amount
+        self.contribution = contribution
+        self.amount.setflags(write = False)
+        self.contribution.setflags(write = False)
+
+    def __len__(self):
+        return len(self.amount)
+
+    @property
+    def months(self):
+        return np.arange(1, len(self) + 1)
+
+    @property
+    def principal(self):
+        return np.full(len(self), self.p)
+
+    @property
+    def cumulative_contribution(self):
+        return np.cumsum(self.contribution)
+
+    @property
+    def interest(self):
+        prev_amount = np.concatenate(([self.p], self.amount[:-1]))
+        return self.amount - (prev_amount + self.contribution)
+
+    @property
+    def cumulative_interest(self):
+        return self.amount - self.p - self.cumulative_contribution
+
+    @property
+    def final_amount(self):
+        return self.amount[-1] if len(self) else self.p
+
+    @property
+    def total_contributions(self):
+        return self.contribution.sum()
+
+    @property
+    def total_interest(self):
+        return self.final_amount - self.p - self.total_contributions
+
+    def to_frame(self, rows = None):
+        """
+        Same DataFrame as cpd_interest_v4_2. rows: optional index array to only build some of the rows
+        """
+        columns = {
+            'Month': self.months,
+            'Principal': self.principal,
+            'Amount': self.amount,
+            'Interest': self.interest,
+            'Cumulative_Interest': self.cumulative_interest,
+            'Contribution': self.contribution,
+            'Cumulative_Contribution': self.cumulative_contribution,
+        }
+        if rows is not None:
+            columns = {name: values[rows] for name, values in columns.items()}
+        df = pd.DataFrame(columns, columns = CPD_COLUMNS)
+        df = df.round(2)
+
+        ### see cpd_interest_loop
+        df['Amount_Marker'] = 0
+
+        return df
+
+    def bucketed(self, step):
+        """
+        DataFrame with one row per `step` periods: the last period of each bucket, except Interest and Contribution
+        which are summed over the bucket. Amount and the cumulative columns are exact at the end of each bucket.
+        """
+        if step <= 1 or len(self) == 0:
+            return self.to_frame()
+        starts = np.arange(0, len(self), step)
+        ends = np.minimum(starts + step, len(self)) - 1
+        df = self.to_frame(rows = ends)
+        df['Interest'] = np.add.reduceat(self.interest, starts).round(2)
+        df['Contribution'] = np.add.reduceat(self.contribution, starts).round(2)
+        return df
+
+
+def amount_recurrence(p, g, contributions):
+    """
+    amount_i = (amount_{i-1} + contribution_i) * g one period at a time, same float ops as cpd_interest_loop.
+    """
+    amounts = []
+    amount = p
+    for contribution in contributions.tolist():
+        amount += contribution
+        amount = amount * g
+        amounts.append(amount)
+    return np.array(amounts, dtype = float)
+
+
+def growth_table(g, periods):
+    """
+    (growth, discount) for k = 1..periods: growth = g^k and discount = g / g^k, read-only and shared through
+    growth_tables. A cached table that is long enough is sliced; a longer one replaces it, up to
+    GROWTH_TABLE_MAX_PERIODS (longer ones aren't cached).
+    """
+    g = float(g)
+    table = growth_tables.get(g)
+    if table is None or len(table[0]) < periods:
+        with np.errstate(over = 'ignore', divide = 'ignore', invalid = 'ignore'):
+            growth = g ** np.arange(1, periods + 1, dtype = float)
+            discount = g / growth
+        growth.setflags(write = False)
+        discount.setflags(write = False)
+        table = (growth, discount)
+        if periods <= GROWTH_TABLE_MAX_PERIODS:
+            growth_tables.put(g, table)
+    return table[0][:periods], table[1][:periods]
+
+
+def compound_amounts(amount, g, contributions):
+    """
+    Amount after each of len(contributions) periods, starting from `amount`.
+
+    The loop does amount = (amount + contribution) * g every period, with g = 1 + r/n. Unrolled, that is
+        amount_i = g^i * (amount_0 + sum_{k <= i} contribution_k * g^(1 - k))
+    so the whole series is one cumsum against the (cached) growth table of g.
+    """
+    growth, discount = growth_table(g, len(contributions))
+    with np.errstate(over = 'ignore', invalid = 'ignore'):
+        amounts = growth * (amount + np.cumsum(contributions * discount))
+
+    # g == 0 or a growth factor that over/underflows float64: the closed form breaks down, the recurrence does not
+    if not np.all(np.isfinite(amounts)) or (len(growth) and not np.all(growth)):
+        amounts = amount_recurrence(amount, g, contributions)
+    return amounts
+
+
+def cpd_interest_result(p, r, t, con, type_con, start_con, stop_con, n):
+    """
+    Vectorized cpd_interest_v4_2, returning a CpdResult. See cpd_interest_v4_2 for the parameters.
+    """
+    months, contributions = contribution_vector(con, type_con, start_con, stop_con, t * n)
+    return CpdResult(p, compound_amounts(p, 1 + r/n, contributions), contributions)
+
+
+def resume_result(base, base_t, base_stop_con, p, r, t, con, type_con, start_con, stop_con, n):
+    """
+    cpd_interest_result for (t, stop_con), computed from `base`, the result of the same parameters with
+    (base_t, base_stop_con). Periods before the first one whose contribution differs are reused as they are; the
+    rest is simulated from the amount at that point. Costs O(changed periods) instead of O(t * n).
+    """
+    periods = int(t * n)
+    # contributions only differ between the two stop_con
+    first_changed = min(base_stop_con, stop_con) + 1 if stop_con != base_stop_con else float('inf')
+    kept = int(min(len(base), periods, max(first_changed - 1, 0)))
+
+    # same dtype as contribution_vector over the whole range would give
+    counts = {'type_con': type_con, 'start_con': start_con, 'stop_con': stop_con}
+    dtype = np.where(True, con, 0).dtype if contribution_count(counts, periods) > 0 else np.arange(1).dtype
+    if kept == periods:
+        return CpdResult(p, base.amount[:kept], base.contribution[:kept].astype(dtype, copy = False))
+
+    months, contributions = contribution_vector(con, type_con, start_con, stop_con, periods, first = kept + 1)
+    start = base.amount[kept - 1] if kept else p
+    amounts = compound_amounts(start, 1 + r/n, contributions)
+    return CpdResult(
+        p,
+        np.concatenate((base.amount[:kept], amounts)),
+        np.concatenate((base.contribution[:kept], contributions)).astype(dtype, copy = False),
+    )
+
+
+def cpd_interest_np(p, r, t, con, type_con, start_con, stop_con, n):
+    """
+    Vectorized cpd_interest_v4_2. Same parameters and DataFrame as the loop.
+    """
+    return cpd_interest_result(p, r, t, con, type_con, start_con, stop_con, n).to_frame()
+
+
+### contribution schedules: contributions (and, negative, withdrawals) as sparse (period, amount) events
+def recurring_events(amount, every, start, stop, periods, raise_by = 0.0, raise_every = None):
+    """
+    amount every `every` periods between start and min(stop, periods), on the same periods as contribution_vector.
+    raise_by: step-up, eg 0.03 raises the amount by 3% every raise_every periods (counted from start)
+
+    return: (event periods, event amounts)
+    """
+    first = max(np.ceil(start / every), 1) * every
+    event_periods = np.arange(first, min(np.floor(stop), periods) + 1, every, dtype = np.int64)
+    amounts = np.full(len(event_periods), float(amount))
+    if raise_by and raise_every:
+        amounts *= (1 + raise_by) ** ((event_periods - start) // raise_every)
+    return event_periods, amounts
+
+
+def lump_sum(period, amount):
+    """
+    One-off event. A negative amount is a withdrawal.
+    """
+    return np.array([period], dtype = np.int64), np.array([float(amount)])
+
+
+def event_arrays(events):
+    """
+    The (periods, amounts) pairs of a schedule as two flat arrays.
+    """
+    if not events:
+        return np.zeros(0, dtype = np.int64), np.zeros(0)
+    event_periods = np.concatenate([np.atleast_1d(pair[0]) for pair in events]).astype(np.int64)
+    amounts = np.concatenate([np.atleast_1d(pair[1]) for pair in events]).astype(float)
+    return event_periods, amounts
+
+
+def schedule_contributions(events, periods):
+    """
+    events: list of (periods, amounts) pairs, eg from recurring_events / lump_sum, in any order
+    return: contribution of each period 1..periods. Events on the same period add up, events outside the horizon are dropped
+    """
+    event_periods, amounts = event_arrays(events)
+    inside = (event_periods >= 1) & (event_periods <= periods)
+    # scatter-add: one pass over the events, one over the periods
+    return np.bincount(event_periods[inside] - 1, weights = amounts[inside], minlength = periods)
+
+
+def cpd_interest_schedule(p, r, t, n, events):
+    """
+    cpd_interest_result with the contributions given by a schedule instead of con / type_con / start_con / stop_con.
+    p, r, t, n: as in cpd_interest_v4_2
+    events: see schedule_contributions. Contributions are added at the start of their period, like in the loop
+
+    return: CpdResult
+    """
+    contributions = schedule_contributions(events, int(t * n))
+    return CpdResult(p, compound_amounts(p, 1 + r/n, contributions), contributions)
+
+
+### rate timelines: piecewise-constant rates, eg accumulation then drawdown
+def timeline_segments(segments, periods):
+    """
+    segments: [(first_period, r), ...] sorted by first_period, the first one starting at period 1. Each rate applies
+        until the next segment starts
+    return: [(start, end, r), ...] clipped to periods 1..periods
+    """
+    starts = [int(start) for start, r in segments]
+    if not starts or starts[0] != 1 or any(b <= a for a, b in zip(starts, starts[1:])):
+        raise ValueError('segments must start at period 1 and be sorted by first period, got {!r}'.format(segments))
+    ends = starts[1:] + [periods + 1]
+    rates = [r for start, r in segments]
+    return [(start, min(end - 1, periods), r) for start, end, r in zip(starts, ends, rates) if start <= periods]
+
+
+def recurring_segment_sum(con, type_con, start_con, stop_con, start, end, g):
+    """
+    What the recurring contributions (see contribution_vector) made in periods start..end are worth at the end of
+    period end, each growing by g every period from its own on. Geometric series, same as final_amount_batch.
+    """
+    m0 = max(np.ceil(max(start_con, start) / type_con), 1)
+    m1 = np.floor(min(stop_con, end) / type_con)
+    count = m1 - m0 + 1
+    if count <= 0 or con == 0:
+        return 0.0
+    if g <= 0:
+        months = np.arange(m0, m1 + 1) * type_con
+        return float(con * (g ** (end - months + 1)).sum())
+    log_g = np.log(g)
+    # (h^count - 1) / (h - 1) for h = g^type_con, with expm1 so rates close to 0 don't lose precision
+    series = count if abs(log_g * type_con) < 1e-15 else np.expm1(count * type_con * log_g) / np.expm1(type_con * log_g)
+    return float(con * np.exp((end + 1 - m1 * type_con) * log_g) * series)
+
+
+def timeline_segment_amounts(p, segments, t, n, con = 0, type_con = 1, start_con = 1, stop_con = np.inf, events = None):
+    """
+    Amount at the end of every segment of a rate timeline (the last one is the final amount), without building any
+    per-period arrays: each segment is one compound step for what came before plus the annuity of its contributions.
+    Costs O(segments + events) instead of O(t * n).
+
+    p, t, n, con, type_con, start_con, stop_con: as in cpd_interest_v4_2 (no contributions by default)
+    segments: see timeline_segments
+    events: optional extra contributions / withdrawals, see schedule_contributions
+    """
+    periods = int(t * n)
+    event_periods, event_amounts = event_arrays(events)
+    order = np.argsort(event_periods, kind = 'stable')
+    event_periods, event_amounts = event_periods[order], event_amounts[order]
+    amount = p
+    amounts = []
+    for start, end, r in timeline_segments(segments, periods):
+        g = 1 + r/n
+        amount = amount * g ** (end - start + 1) + recurring_segment_sum(con, type_con, start_con, stop_con, start, end, g)
+        lo, hi = np.searchsorted(event_periods, [start, end + 1])
+        if hi > lo:
+            amount += float((event_amounts[lo:hi] * g ** (end - event_periods[lo:hi] + 1)).sum())
+        amounts.append(amount)
+    return np.array(amounts, dtype = float)
+
+
+def cpd_interest_timeline(p, segments, t, n, con = 0, type_con = 1, start_con = 1, stop_con = np.inf, events = None):
+    """
+    Per-period version of timeline_segment_amounts, for charts. Every segment is compounded with compound_amounts,
+    starting from the amount the previous one ended on.
+
+    return: CpdResult
+    """
+    periods = int(t * n)
+    months, contributions = contribution_vector(con, type_con, start_con, stop_con, periods)
+    contributions = contributions.astype(float)
+    if events:
+        contributions += schedule_contributions(events, periods)
+
+    amounts = np.empty(periods)
+    amount = p
+    for start, end, r in timeline_segments(segments, periods):
+        amounts[start - 1:end] = compound_amounts(amount, 1 + r/n, contributions[start - 1:end])
+        amount = amounts[end - 1]
+    return CpdResult(p, amounts, contributions)
+
+
+def compare_engines(p, r, t, con, type_con, start_con, stop_con, n, tolerance = 0.01):
+    """
+    Runs both engines on the same inputs and returns the largest absolute difference per column.
+    Raises AssertionError if any column differs by more than tolerance (default: one cent).
+    """
+    loop_df = cpd_interest_loop(p, r, t, con, type_con, start_con, stop_con, n)
+    np_df = cpd_interest_np(p, r, t, con, type_con, start_con, stop_con, n)
+
+    assert list(loop_df.columns) == list(np_df.columns), 'column mismatch'
+    diffs = (loop_df - np_df).abs().max()
+    worst = diffs.max() if len(diffs) else 0
+    # both sides are already rounded to cents, leave a little slack for the float subtraction itself
+    assert not worst > tolerance + 1e-6, 'engines differ by {} (> {})\n{}'.format(worst, tolerance, diffs)
+    return diffs
+
+
+def normalize_params(p, r, t, con, type_con, start_con, stop_con, n):
+    """
+    Cache key for a set of cpd_interest_v4_2 parameters. Every value is converted to float so 1, 1.0 and np.int64(1) share an entry.
+    """
+    return tuple(float(x) for x in (p, r, t, con, type_con, start_con, stop_con, n))
+
+
+def cpd_result_cached(p, r, t, con, type_con, start_con, stop_con, n):
+    """
+    cpd_interest_result behind simulation_cache, then shared_result_cache. The CpdResult is shared with the cache,
+    its arrays are read-only (memory-mapped when they come from shared_result_cache).
+    On a miss, a checkpointed run that only differs in t and / or stop_con is resumed instead of starting over.
+    """
+    key = normalize_params(p, r, t, con, type_con, start_con, stop_con, n) + ('numpy',)
+    return simulation_cache.get_or_compute(
+        key, lambda: cpd_result_shared(key, p, r, t, con, type_con, start_con, stop_con, n)
+    )
+
+
+def cpd_result_shared(key, p, r, t, con, type_con, start_con, stop_con, n):
+    compute = lambda: cpd_result_resumed(p, r, t, con, type_con, start_con, stop_con, n)
+    if shared_result_cache is None:
+        return compute()
+    return shared_result_cache.get_or_compute(key, compute, pack_result, unpack_result)
+
+
+### CpdResult <-> arrays for shared_result_cache. p is kept as a 1 element array so its int / float type survives
+def pack_result(result):
+    return [np.array([result.p]), result.amount, result.contribution]
+
+
+def unpack_result(arrays):
+    p, amount, contribution = arrays
+    return CpdResult(p[0], amount, contribution)
+
+
+def cpd_result_resumed(p, r, t, con, type_con, start_con, stop_con, n):
+    family = normalize_params(p, r, 0, con, type_con, start_con, 0, n)
+    checkpoint = checkpoint_cache.get(family)
+    if checkpoint is None:
+        result = cpd_interest_result(p, r, t, con, type_con, start_con, stop_con, n)
+    else:
+        base_t, base_stop_con, base = checkpoint
+        result = resume_result(base, base_t, base_stop_con, p, r, t, con, type_con, start_con, stop_con, n)
+    checkpoint_cache.put(family, (t, stop_con, result))
+    return result
+
+
+def cpd_interest_cached(p, r, t, con, type_con, start_con, stop_con, n, engine = None):
+    """
+    cpd_interest_v4_2 behind simulation_cache. Returns a new frame every time, so it is safe to modify.
+    """
+    engine = engine or DEFAULT_ENGINE
+    if engine == 'numpy':
+        return cpd_result_cached(p, r, t, con, type_con, start_con, stop_con, n).to_frame()
+    key = normalize_params(p, r, t, con, type_con, start_con, stop_con, n) + (engine,)
+    return simulation_cache.get_or_compute(
+        key, lambda: cpd_interest_v4_2(p, r, t, con, type_con, start_con, stop_con, n, engine = engine)
+    )
+
+
+### batch engine
+PARAM_NAMES = ['p', 'r', 't', 'con', 'type_con', 'start_con', 'stop_con', 'n']
+
+### roughly how many (scenario, period) cells are worked on at once. Bounds the temporaries to a few hundred MB
+BATCH_CHUNK_CELLS = 4_000_000
+
+
+def batch_params(params):
+    """
+    Turns a DataFrame of parameter rows (columns named like PARAM_NAMES) or a dict of scalars / arrays into
+    a dict of equal length 1d float arrays.
+    """
+    if isinstance(params, pd.DataFrame):
+        missing = [name for name in PARAM_NAMES if name not in params.columns]
+        if missing:
+            raise ValueError('missing parameter columns: {}'.format(missing))
+        params = {name: params[name].to_numpy() for name in PARAM_NAMES}
+    arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(params[name], dtype = float)) for name in PARAM_NAMES])
+    return {name: np.ascontiguousarray(array) for name, array in zip(PARAM_NAMES, arrays)}
+
+
+class BatchResult:
+    """
+    Result of cpd_interest_batch. amount is a (scenario x period) array, period i in column i - 1.
+    Rows are padded with NaN after each scenario's last period (periods[k] = t * n).
+    The other columns of the scalar DataFrame are derived from amount and the params when asked for.
+    """
+
+    def __init__(self, params, periods, amount):
+        self.params = params
+        self.periods = periods
+        self.amount = amount
+
+    def __len__(self):
+        return len(self.periods)
+
+    @property
+    def months(self):
+        return np.arange(1, self.amount.shape[1] + 1)
+
+    @property
+    def valid(self):
+        return self.months <= self.periods[:, None]
+
+    @property
+    def contribution(self):
+        return batch_contributions(self.params, self.months, self.periods)
+
+    @property
+    def cumulative_contribution(self):
+        return np.where(self.valid, np.cumsum(self.contribution, axis = 1), np.nan)
+
+    @property
+    def cumulative_interest(self):
+        return self.amount - self.params['p'][:, None] - self.cumulative_contribution
+
+    @property
+    def interest(self):
+        prev_amount = np.concatenate((self.params['p'][:, None], self.amount[:, :-1]), axis = 1)
+        return self.amount - prev_amount - self.contribution
+
+    def last(self, values):
+        """
+        Value of a (scenario x period) array at each scenario's last period. NaN for scenarios with no periods.
+        """
+        index = np.maximum(self.periods - 1, 0)
+        out = values[np.arange(len(self)), index] if values.shape[1] else np.full(len(self), np.nan)
+        return np.where(self.periods > 0, out, np.nan)
+
+    @property
+    def final_amount(self):
+        return self.last(self.amount)
+
+    @property
+    def total_contributions(self):
+        return self.params['con'] * contribution_count(self.params, self.periods)
+
+    @property
+    def total_interest(self):
+        return self.final_amount - self.params['p'] - self.total_contributions
+
+    def summary(self):
+        df = pd.DataFrame(self.params, columns = PARAM_NAMES)
+        df['Final_Amount'] = self.final_amount
+        df['Total_Interest'] = self.total_interest
+        df['Total_Contribution'] = self.total_contributions
+        return df
+
+    def result(self, k):
+        """
+        Scenario k as a CpdResult.
+        """
+        periods = int(self.periods[k])
+        contribution = batch_contributions({name: array[k:k + 1] for name, array in self.params.items()},
+                                           self.months[:periods], self.periods[k:k + 1])[0]
+        return CpdResult(self.params['p'][k], self.amount[k, :periods].copy(), contribution)
+
+    def to_frame(self, k):
+        """
+        Scenario k as the same DataFrame cpd_interest_v4_2 returns.
+        """
+        return self.result(k).to_frame()
+
+    def long_frame(self, first_scenario = 0):
+        """
+        Every scenario's periods in one DataFrame: a Scenario column (numbered from first_scenario) then the
+        columns of cpd_interest_v4_2, one row per (scenario, period), rounded like it.
+        """
+        valid = self.valid
+        scenario, period = np.nonzero(valid)
+        columns = {
+            'Scenario': scenario + first_scenario,
+            'Month': period + 1,
+            'Principal': self.params['p'][scenario],
+            'Amount': self.amount[valid],
+            'Interest': self.interest[valid],
+            'Cumulative_Interest': self.cumulative_interest[valid],
+            'Contribution': self.contribution[valid],
+            'Cumulative_Contribution': self.cumulative_contribution[valid],
+        }
+        return pd.DataFrame(columns, columns = ['Scenario'] + CPD_COLUMNS).round(2)
+
+
+def contribution_count(params, periods):
+    """
+    How many contributions each scenario makes: multiples of type_con between start_con and min(stop_con, periods).
+    """
+    type_con = params['type_con']
+    lo = np.maximum(np.ceil(params['start_con']), 1)
+    hi = np.minimum(np.floor(params['stop_con']), periods)
+    count = np.floor(hi / type_con) - np.floor((lo - 1) / type_con)
+    return np.where(hi >= lo, count, 0)
+
+
+def batch_contributions(params, months, periods):
+    mask = (
+        (months <= periods[:, None])
+        & (months % params['type_con'][:, None] == 0)
+        & (months >= params['start_con'][:, None])
+        & (months <= params['stop_con'][:, None])
+    )
+    return np.where(mask, params['con'][:, None], 0.0)
+
+
+def batch_amounts(params, periods, width):
+    """
+    Amount for every scenario in params over periods 1..width, using the same closed form as cpd_interest_np
+    on a 2d grid. Rows where the closed form breaks down (g == 0, overflow) are redone with the recurrence.
+    """
+    months = np.arange(1, width + 1)
+    contributions = batch_contributions(params, months, periods)
+    g = (1 + params['r'] / params['n'])[:, None]
+    p = params['p'][:, None]
+
+    with np.errstate(over = 'ignore', divide = 'ignore', invalid = 'ignore'):
+        # sweeps and batches usually share a handful of growth factors: gather their rows from the growth tables
+        g_unique, inverse = np.unique(g[:, 0], return_inverse = True)
+        if len(g_unique) <= GROWTH_TABLE_SIZE:
+            tables = [growth_table(value, width) for value in g_unique]
+            growth = np.stack([table[0] for table in tables])[inverse]
+            discount = np.stack([table[1] for table in tables])[inverse]
+        else:
+            growth = g ** months
+            discount = g / growth
+        amounts = growth * (p + np.cumsum(contributions * discount, axis = 1))
+
+    bad = ~(np.isfinite(amounts).all(axis = 1) & (growth != 0).all(axis = 1))
+    if bad.any():
+        # one vectorized step per period, but only across the rows that need it
+        amount = p[bad, 0].copy()
+        with np.errstate(over = 'ignore', invalid = 'ignore'):
+            for i in range(width):
+                amount = (amount + contributions[bad, i]) * g[bad, 0]
+                amounts[bad, i] = amount
+
+    amounts[months > periods[:, None]] = np.nan
+    return amounts
+
+
+def cpd_interest_batch(params, chunk_size = None):
+    """
+    Simulates many parameter sets in one vectorized pass.
+
+    params: DataFrame with one row per scenario and columns p, r, t, con, type_con, start_con, stop_con, n,
+        or a dict of those names to scalars / arrays (broadcast against each other)
+    chunk_size: scenarios per chunk. Defaults to what fits in BATCH_CHUNK_CELLS
+
+    return: BatchResult. Values are not rounded.
+    """
+    params = batch_params(params)
+    periods = np.rint(params['t'] * params['n']).astype(np.int64)
+    width = int(periods.max(initial = 0))
+
+    if chunk_size is None:
+        chunk_size = max(1, BATCH_CHUNK_CELLS // max(width, 1))
+
+    amount = np.full((len(periods), width), np.nan)
+    for start in range(0, len(periods), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        chunk_params = {name: array[chunk] for name, array in params.items()}
+        chunk_width = int(periods[chunk].max(initial = 0))
+        amount[chunk, :chunk_width] = batch_amounts(chunk_params, periods[chunk], chunk_width)
+
+    return BatchResult(params, periods, amount)
+
+
+def final_amount_batch(params):
+    """
+    Final Amount only, for every scenario in params (see cpd_interest_batch), without building any per-period arrays.
+
+    Contributions land on periods k = m * type_con for m0 <= m <= m1 and each grows by g^(T - k + 1), so their total
+    is a geometric series in h = g^type_con:
+        amount_T = p * g^T + con * g^(T + 1 - m1 * type_con) * (h^c - 1) / (h - 1),   c = m1 - m0 + 1
+    Scenarios where this isn't usable (g <= 0, or NaN from 0 * inf / inf - inf) go through cpd_interest_batch
+    instead. An amount that really overflows stays inf, as the per-period engines give.
+    """
+    params = batch_params(params)
+    periods = np.rint(params['t'] * params['n'])
+    type_con = params['type_con']
+    g = 1 + params['r'] / params['n']
+
+    lo = np.maximum(np.ceil(params['start_con']), 1)
+    hi = np.minimum(np.floor(params['stop_con']), periods)
+    m0 = np.ceil(lo / type_con)
+    m1 = np.floor(hi / type_con)
+    count = np.maximum(m1 - m0 + 1, 0)
+
+    with np.errstate(over = 'ignore', divide = 'ignore', invalid = 'ignore'):
+        log_g = np.log(g)
+        # (h^c - 1) / (h - 1) with expm1 so rates close to 0 don't lose precision
+        series = np.where(
+            np.abs(log_g * type_con) < 1e-15,
+            count,
+            np.expm1(count * type_con * log_g) / np.expm1(type_con * log_g),
+        )
+        contributions = params['con'] * np.exp((periods + 1 - m1 * type_con) * log_g) * series
+        amount = params['p'] * np.exp(periods * log_g) + np.where(count > 0, contributions, 0)
+
+    amount = np.where(periods > 0, amount, np.nan)
+    bad = (g <= 0) | ((periods > 0) & np.isnan(amount))
+    if bad.any():
+        bad_params = {name: array[bad] for name, array in params.items()}
+        amount[bad] = cpd_interest_batch(bad_params).final_amount
+    return amount
+
+
+def summary_batch(params):
+    """
+    Same DataFrame as cpd_interest_batch(params).summary(), from final_amount_batch: no per-period arrays,
+    so it runs at the cost of a few array operations per scenario whatever the horizons.
+    """
+    params = batch_params(params)
+    periods = np.rint(params['t'] * params['n'])
+    final_amount = final_amount_batch(params)
+    total_contributions = params['con'] * contribution_count(params, periods)
+
+    df = pd.DataFrame(params, columns = PARAM_NAMES)
+    df['Final_Amount'] = final_amount
+    df['Total_Interest'] = final_amount - params['p'] - total_contributions
+    df['Total_Contribution'] = total_contributions
+    return df
+
+
+### parameters that only make sense as whole numbers
+INTEGER_PARAMS = ['t', 'type_con', 'start_con', 'stop_con', 'n']
+
+
+def sweep_values(name, start, stop, steps):
+    """
+    Evenly spaced values for a swept parameter. Integer parameters are rounded and de-duplicated.
+    """
+    values = np.linspace(start, stop, int(steps))
+    if name in INTEGER_PARAMS:
+        values = np.unique(np.rint(values))
+    return values
+
+
+def sweep_final_amount(base, x_name, x_values, y_name, y_values):
+    """
+    Final Amount over a grid of two parameters, all other parameters taken from base (dict of PARAM_NAMES).
+
+    return: (len(y_values), len(x_values)) array, ready for a heatmap's z
+    """
+    if x_name == y_name:
+        raise ValueError('sweep needs two different parameters, got {!r} twice'.format(x_name))
+    x_grid, y_grid = np.meshgrid(np.asarray(x_values, dtype = float), np.asarray(y_values, dtype = float))
+    params = dict(base)
+    params[x_name] = x_grid.ravel()
+    params[y_name] = y_grid.ravel()
+    return final_amount_batch(params).reshape(x_grid.shape)
@@ -0,0 +1,8 @@
+"""
+Puts the repo root on sys.path for the tests, and keeps them off the on-disk result cache.
+"""
+import os
+import sys
+
+os.environ.setdefault('CPD_SHARED_CACHE', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+
+from cache import LRUCache, MmapArrayCache
+
+ARRAYS = [np.array([1.5]), np.arange(10, dtype = float), np.array([1, 2, 3])]
+
+
+def test_lru_cache_evicts_the_least_recently_used():
+    cache = LRUCache(maxsize = 2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+
+
+def test_mmap_cache_round_trip(tmp_path):
+    cache = MmapArrayCache(str(tmp_path), version = 'v1')
+    cache.put(('key', 1.0), ARRAYS)
+    arrays = cache.get(('key', 1.0))
+    assert len(arrays) == len(ARRAYS)
+    for array, expected in zip(arrays, ARRAYS):
+        np.testing.assert_array_equal(array, expected)
+    assert arrays[2].dtype.kind == 'i'
+    assert cache.get(('key', 2.0)) is None
+
+
+def test_mmap_cache_other_version_is_a_miss(tmp_path):
+    MmapArrayCache(str(tmp_path), version = 'v1').put('key', ARRAYS)
+    assert MmapArrayCache(str(tmp_path), version = 'v2').get('key') is None
+
+
+def test_mmap_cache_header_of_other_version_is_a_miss(tmp_path):
+    # same file name (eg an entry from a build with the old file format), but another version in the header
+    old, new = MmapArrayCache(str(tmp_path), version = 'v1'), MmapArrayCache(str(tmp_path), version = 'v2')
+    old.put('key', ARRAYS)
+    os.replace(old._path('key'), new._path('key'))
+    assert new.get('key') is None
+    assert not os.path.exists(new._path('key'))
+
+
+@pytest.mark.parametrize('size', [0, 5, 30, -8])
+def test_mmap_cache_truncated_entry_is_a_miss(tmp_path, size):
+    cache = MmapArrayCache(str(tmp_path))
+    cache.put('key', ARRAYS)
+    path = cache._path('key')
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:size])
+    assert cache.get('key', 'missing') == 'missing'
+    assert cache.stats()['misses'] == 1
+
+    compute_calls = []
+    cache.get_or_compute('key', lambda: compute_calls.append(1) or ARRAYS, list, list)
+    assert compute_calls == [1]
+    np.testing.assert_array_equal(cache.get('key')[1], ARRAYS[1])
+
+
+def test_mmap_cache_put_scans_the_directory_only_now_and_then(tmp_path, monkeypatch):
+    cache = MmapArrayCache(str(tmp_path), maxbytes = 100_000, evict_every = 16)
+    scans = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, '_entries', lambda: scans.append(1) or entries())
+    for i in range(1000):
+        cache.put(i, [np.arange(100)])
+    # every evict_every puts, plus once per eviction (each frees 10% of maxbytes, ~12 entries)
+    assert len(scans) <= 1000 // 16 + 1000 // 10
+    assert cache.stats()['size_bytes'] <= cache.maxbytes
+    assert cache.get(999) is not None and cache.get(0) is None
@@ -0,0 +1,92 @@
+"""
+The browser simulation in assets/compounding.js must give the same Amount series as the python engines.
+Needs node on the PATH, skipped otherwise.
+"""
+import itertools
+import json
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from simulation import cpd_interest_loop, cpd_interest_np
+
+JS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'compounding.js')
+
+### p, r, t, con, type_con, start_con, stop_con, n
+PARITY_GRID = list(itertools.product(
+    [0, 1000, 2500.5],
+    [0.1, 0.03, -0.05, 0],
+    [1, 10, 65],
+    [2000, 150.25],
+    [1, 3],
+    [1, 19],
+    [25, 1_000_000],
+    [1, 12, 365],
+))
+
+pytestmark = pytest.mark.skipif(shutil.which('node') is None, reason = 'needs node')
+
+
+def run_js_simulations(grid):
+    """
+    Runs simulate() from assets/compounding.js in node for every parameter set and returns the Amount series.
+    """
+    script = """
+        var compounding = require(%s);
+        var grid = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+        process.stdout.write(JSON.stringify(grid.map(function (params) {
+            return compounding.simulate.apply(null, params).Amount;
+        })));
+    """ % json.dumps(JS_PATH)
+    result = subprocess.run(
+        ['node', '-e', script], input = json.dumps(grid), capture_output = True, text = True, check = True,
+    )
+    return json.loads(result.stdout)
+
+
+@pytest.fixture(scope = 'module')
+def js_amounts():
+    # one node process for the whole grid
+    return run_js_simulations(PARITY_GRID)
+
+
+@pytest.mark.parametrize('index', range(len(PARITY_GRID)), ids = lambda i: '-'.join(map(str, PARITY_GRID[i])))
+def test_js_matches_python_engines(js_amounts, index):
+    """
+    The JS mirrors cpd_interest_loop op for op, so those must match exactly. The numpy engine only has to agree to the cent.
+    """
+    params = PARITY_GRID[index]
+    js_amount = np.array(js_amounts[index], dtype = float)
+    loop_amount = cpd_interest_loop(*params).Amount.to_numpy()
+    np_amount = cpd_interest_np(*params).Amount.to_numpy()
+
+    assert np.array_equal(js_amount, loop_amount), 'js and loop engines differ for {}'.format(params)
+    assert np.abs(js_amount - np_amount).max(initial = 0) <= 0.01 + 1e-6, 'js and numpy engines differ for {}'.format(params)
+
+
+def test_js_comparison_reuses_simulations():
+    parameters = [[1000, 0.07, 10, 100, 1, 1, 120, 12], [0, 0.05, 20, 200, 3, 1, 240, 12]]
+    script = """
+        var compounding = require(%s);
+        var parameters = %s;
+        var skeleton = {data: [{}, {type: 'scatter', customdata: []}], layout: {}};
+        var datas = parameters.map(function (params) { return {parameters: params, n: 12}; });
+        var amount = compounding.cached_amount(parameters[0]);
+        var first = compounding.update_comparison(datas, null, skeleton);
+        var second = compounding.update_comparison(datas, null, skeleton);
+        process.stdout.write(JSON.stringify({
+            cached: amount === compounding.cached_amount(parameters[0]),
+            same: JSON.stringify(first) === JSON.stringify(second),
+            x: first.data.map(function (trace) { return trace.x; }),
+            y: first.data.map(function (trace) { return trace.y; }),
+        }));
+    """ % (json.dumps(JS_PATH), json.dumps(parameters))
+    result = json.loads(subprocess.run(['node', '-e', script], capture_output = True, text = True, check = True).stdout)
+    assert result['cached'] and result['same']
+    for params, x, y in zip(parameters, result['x'], result['y']):
+        amount = cpd_interest_loop(*params).Amount.to_numpy()
+        expected = [amount[month - 1] if month <= len(amount) else None for month in x]
+        assert y == expected
@@ -0,0 +1,70 @@
+import contextlib
+
+import coalescing
+import compounding
+
+FAN_CHART_OUTPUTS = [
+    {'id': 'mc_fan', 'property': 'figure'},
+    {'id': 'mc_job', 'property': 'data'},
+    {'id': 'mc_poll', 'property': 'disabled'},
+    {'id': 'mc_progress', 'property': 'children'},
+]
+
+
+@contextlib.contextmanager
+def dash_request(changed_prop_ids, session = 'session-1'):
+    """
+    A Dash callback request for the fan chart, with the server's before_request hooks run.
+    """
+    body = {'output': 'fan', 'outputs': FAN_CHART_OUTPUTS, 'changedPropIds': changed_prop_ids, 'inputs': []}
+    context = compounding.server.test_request_context(
+        '/_dash-update-component', method = 'POST', json = body,
+        headers = {'Cookie': '{}={}'.format(coalescing.SESSION_COOKIE, session)},
+    )
+    # a nested request context would share the outer one's app context (and flask.g), a served request never does
+    with compounding.server.app_context(), context:
+        compounding.server.preprocess_request()
+        yield
+
+
+def test_newer_input_request_makes_the_older_one_stale():
+    with dash_request(['mc_sigma_input.value']):
+        with dash_request(['mc_seed_input.value']):
+            assert not coalescing.is_stale()
+        assert coalescing.is_stale()
+
+
+def test_interval_request_does_not_make_an_input_request_stale():
+    # a poll tick arrives while the request for new inputs is still computing
+    with dash_request(['mc_sigma_input.value']):
+        with dash_request(['mc_poll.n_intervals']):
+            assert coalescing.request_key() is None
+            assert not coalescing.is_stale()
+        assert not coalescing.is_stale()
+
+
+def test_other_sessions_do_not_coalesce():
+    with dash_request(['mc_sigma_input.value'], session = 'session-1'):
+        with dash_request(['mc_sigma_input.value'], session = 'session-2'):
+            pass
+        assert not coalescing.is_stale()
+
+
+def test_shared_coalescer_sees_requests_from_other_workers(tmp_path):
+    # two workers, each with its own SharedCoalescer on the same directory
+    worker_1 = coalescing.SharedCoalescer(str(tmp_path))
+    worker_2 = coalescing.SharedCoalescer(str(tmp_path))
+    key = ('session-1', 'outputs')
+    token = worker_1.begin(key)
+    assert not worker_1.is_stale(key, token)
+    newer = worker_2.begin(key)
+    assert worker_1.is_stale(key, token)
+    assert not worker_1.is_stale(key, newer)
+    assert not worker_2.is_stale(('session-2', 'outputs'), token)
+
+
+def test_shared_coalescer_cleanup_drops_old_keys(tmp_path):
+    shared = coalescing.SharedCoalescer(str(tmp_path), ttl = -1)
+    shared.begin(('session-1', 'outputs'))
+    shared.cleanup()
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,106 @@
+import dash
+import flask
+import pandas as pd
+import pytest
+
+import compounding
+from montecarlo import monte_carlo
+from simulation import cpd_interest_v4_2
+
+MC_INPUTS = list(compounding.STRATEGY_DEFAULTS[0]) + [0.15, compounding.MAX_MC_PATHS, 0]
+
+
+class FakeJobManager:
+    """
+    Jobs that are already finished, with their state and result set by the test.
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.cancelled = []
+
+    def cancel(self, job_id):
+        self.cancelled.append(job_id)
+
+    def status(self, job_id):
+        return {'state': self.jobs[job_id][0]}
+
+    def progress(self, job_id):
+        return 1.0
+
+    def result(self, job_id):
+        return self.jobs[job_id][1]
+
+
+def call_callback(callback, triggered, *args):
+    """
+    Runs a callback's function as dash would for a request triggered by the prop ids in triggered.
+    """
+    callback = getattr(callback, '__wrapped__', callback)
+    with compounding.server.test_request_context('/_dash-update-component', method = 'POST'):
+        flask.g.triggered_inputs = [{'prop_id': prop_id, 'value': None} for prop_id in triggered]
+        return callback(*args)
+
+
+@pytest.fixture
+def finished_job(monkeypatch):
+    result = monte_carlo(*MC_INPUTS[:8], sigma = 0.15, paths = 16, shards = 1, max_recorded = compounding.MAX_BARS)
+    monkeypatch.setattr(compounding, 'job_manager', FakeJobManager({'J1': ('done', result), 'J2': ('running', None)}))
+    return {'id': 'J1', 'inputs': MC_INPUTS}
+
+
+def test_fan_chart_poll_shows_the_current_job(finished_job):
+    figure, job, disabled, progress = call_callback(
+        compounding.update_fan_chart, ['mc_poll.n_intervals'], *MC_INPUTS, 3, finished_job)
+    assert figure is not dash.no_update
+    assert (job, disabled, progress) == (None, True, '')
+
+
+@pytest.mark.parametrize('state', ['done', 'failed'])
+def test_fan_chart_poll_for_a_replaced_job_changes_nothing(finished_job, state, monkeypatch):
+    # the inputs changed and J2 was submitted for them, while a poll carrying J1 was in flight
+    compounding.job_manager.jobs['J1'] = (state, compounding.job_manager.jobs['J1'][1])
+    new_inputs = list(MC_INPUTS)
+    new_inputs[1] = 0.05
+    response = call_callback(compounding.update_fan_chart, ['mc_poll.n_intervals'], *new_inputs, 3, finished_job)
+    assert response == [dash.no_update] * 4
+
+
+def test_fan_chart_submits_a_job_tagged_with_its_inputs(finished_job, monkeypatch):
+    monkeypatch.setattr(compounding, 'submit_monte_carlo', lambda *args, **kwargs: 'J2')
+    figure, job, disabled, _ = call_callback(
+        compounding.update_fan_chart, ['mc_sigma_input.value'], *MC_INPUTS, 3, {'id': 'J1', 'inputs': MC_INPUTS})
+    assert figure is dash.no_update
+    assert job == {'id': 'J2', 'inputs': MC_INPUTS}
+    assert disabled is False
+    # the job it replaces is stopped
+    assert compounding.job_manager.cancelled == ['J1']
+
+
+@pytest.mark.parametrize('t1, t2', [(65, 65), (65, 40), (10, 30)])
+def test_merge_cpd_dfs_matches_an_outer_merge(t1, t2):
+    df1 = cpd_interest_v4_2(0, 0.1, t1, 2_000, 1, 19, 25, 12)
+    df2 = cpd_interest_v4_2(0, 0.1, t2, 2_000, 1, 26, 65, 12)
+    expected = df1.merge(df2, on = 'Month', how = 'outer').round(2)
+    pd.testing.assert_frame_equal(compounding.merge_cpd_dfs(df1, df2), expected, check_dtype = False)
+    assert list(compounding.merge_cpd_dfs(df1, df2, columns = ['Amount']).columns) == ['Month', 'Amount_x', 'Amount_y']
+
+
+def test_strategy_store_keeps_only_parameters():
+    parameters = [0, 0.1, 65, 2_000, 1, 19 * 365, 25 * 365, 365]
+    _, data = compounding.update_bar(*parameters)
+    assert data == {'parameters': parameters, 'n': 365}
+
+    figure = compounding.update_comparison([data, data], [{'index': 0}, {'index': 3}])
+    assert [trace['name'] for trace in figure['data']] == ['Returns A', 'Returns D']
+    assert figure['data'][0]['y'][-1] == cpd_interest_v4_2(*parameters).Amount.iloc[-1]
+
+
+def test_fan_chart_runs_long_horizons_as_jobs(monkeypatch):
+    # few paths, but daily periods over 65 years: too many cells to simulate inside the request
+    monkeypatch.setattr(compounding, 'submit_monte_carlo', lambda *args, **kwargs: 'J3')
+    monkeypatch.setattr(compounding, 'monte_carlo', None)
+    inputs = [0, 0.1, 65, 2_000, 1, 1, 65 * 365, 365, 0.15, 20_000, 0]
+    _, job, disabled, _ = call_callback(compounding.update_fan_chart, ['mc_paths_input.value'], *inputs, 0, None)
+    assert job == {'id': 'J3', 'inputs': inputs}
+    assert disabled is False
@@ -0,0 +1,81 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import compounding
+import export
+from simulation import cpd_interest_batch, cpd_interest_v4_2
+
+QUERY = 'p=1000&r=0.1&t=65&con=2000&type_con=1&start_con=19&stop_con=25&n=12'
+
+### short and long (more than BLOCK_ROWS periods) scenarios, mixed
+SCENARIOS = pd.DataFrame({
+    'p': [0, 1_000, 500, 0, 250, 100],
+    'r': [0.1, 0.05, 0.07, 0.02, 0.1, 0],
+    't': [3, 40, 2, 1, 30, 5],
+    'con': [100, 0, 50, 10, 20, 5],
+    'type_con': [1, 1, 3, 1, 2, 1],
+    'start_con': [1, 1, 1, 2, 1, 1],
+    'stop_con': [30, 1, 20, 5, 200, 60],
+    'n': [12, 12, 12, 365, 12, 12],
+})
+BLOCK_ROWS = 100
+
+
+def test_batch_blocks_are_bounded_and_complete():
+    blocks = list(export.batch_blocks(SCENARIOS, block_rows = BLOCK_ROWS))
+    assert all(len(block) <= BLOCK_ROWS for block in blocks)
+    exported = pd.concat(blocks, ignore_index = True)
+    expected = cpd_interest_batch(SCENARIOS).long_frame()
+    pd.testing.assert_frame_equal(exported, expected, check_dtype = False)
+
+
+def test_export_single_run_csv():
+    response = compounding.server.test_client().get('/export?' + QUERY)
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'identity'
+    expected = cpd_interest_v4_2(1000, 0.1, 65, 2000, 1, 19, 25, 12).drop(columns = 'Amount_Marker')
+    np.testing.assert_allclose(pd.read_csv(io.BytesIO(response.data)).to_numpy(), expected.to_numpy())
+
+
+def test_parquet_stream_of_mixed_blocks():
+    pytest.importorskip('pyarrow')
+    data = b''.join(export.parquet_stream(export.batch_blocks(SCENARIOS, block_rows = BLOCK_ROWS)))
+    exported = pd.read_parquet(io.BytesIO(data))
+    pd.testing.assert_frame_equal(exported, cpd_interest_batch(SCENARIOS).long_frame(), check_dtype = False)
+
+
+def test_export_posted_scenarios_csv():
+    response = compounding.server.test_client().post(
+        '/export', data = SCENARIOS.to_csv(index = False), content_type = 'text/csv')
+    assert response.status_code == 200
+    exported = pd.read_csv(io.BytesIO(response.data))
+    pd.testing.assert_frame_equal(exported, cpd_interest_batch(SCENARIOS).long_frame(), check_dtype = False)
+
+
+def test_export_bad_requests():
+    client = compounding.server.test_client()
+    assert client.get('/export?p=1').status_code == 400
+    assert client.get('/export?format=xls&' + QUERY).status_code == 400
+
+
+@pytest.mark.parametrize('query', [
+    QUERY.replace('n=12', 'n=0'),
+    QUERY.replace('type_con=1', 'type_con=0'),
+    QUERY.replace('t=65', 't=100000000').replace('n=12', 'n=365'),
+    QUERY + '&sweep_x=r&sweep_x_min=0&sweep_x_max=0.1&sweep_y=t&sweep_y_min=1&sweep_y_max=60&steps=100000',
+    QUERY + '&sweep_x=r&sweep_x_min=0&sweep_x_max=0.1&sweep_y=n&sweep_y_min=0&sweep_y_max=12&steps=10',
+    QUERY + '&sweep_x=r&sweep_x_min=0&sweep_x_max=0.1&sweep_y=t&sweep_y_min=1&sweep_y_max=1e9&steps=10',
+])
+def test_export_rejects_parameters_before_simulating(query):
+    response = compounding.server.test_client().get('/export?' + query)
+    assert response.status_code == 400
+
+
+def test_export_rejects_posted_scenarios_that_cant_run():
+    scenarios = SCENARIOS.assign(n = [12, 0, 12, 365, 12, 12])
+    response = compounding.server.test_client().post(
+        '/export', data = scenarios.to_csv(index = False), content_type = 'text/csv')
+    assert response.status_code == 400
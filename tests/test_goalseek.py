@@ -0,0 +1,44 @@
+import pytest
+
+from goalseek import RATE_BRACKET, goal_seek
+from simulation import PARAM_NAMES, final_amount_batch
+
+### Mary from the README
+MARY = dict(p = 0, r = 0.1, t = 65, con = 2_000, type_con = 1, start_con = 19, stop_con = 25, n = 1)
+
+
+def final_amount(**params):
+    return final_amount_batch({name: [params[name]] for name in PARAM_NAMES})[0]
+
+
+@pytest.mark.parametrize('solve_for', ['con', 'r'])
+def test_goal_seek_reaches_the_target(solve_for):
+    target = 2_000_000
+    value = goal_seek(target, solve_for, **MARY)
+    assert final_amount(**dict(MARY, **{solve_for: value})) == pytest.approx(target)
+
+
+def test_solve_rate_target_met_at_every_rate():
+    # the principal alone is more than the target, even at the lowest rate
+    params = dict(MARY, p = 1_000_000, t = 1)
+    with pytest.raises(ValueError, match = 'reached at any rate'):
+        goal_seek(100, 'r', **params)
+
+
+def test_solve_con_target_met_without_contributions():
+    params = dict(MARY, p = 1_000_000, t = 30)
+    with pytest.raises(ValueError, match = 'reached at any contribution'):
+        goal_seek(100, 'con', **params)
+    # exactly the principal's final amount needs no contribution at all
+    assert goal_seek(final_amount(**dict(params, con = 0)), 'con', **params) == 0
+
+
+def test_solve_rate_target_never_reached():
+    with pytest.raises(ValueError, match = 'no rate'):
+        goal_seek(1e30, 'r', **dict(MARY, t = 1))
+
+
+def test_solve_rate_target_at_the_lower_bound():
+    params = dict(MARY, p = 1_000, t = 1, con = 0)
+    target = final_amount(**dict(params, r = RATE_BRACKET[0]))
+    assert goal_seek(target, 'r', **params) == pytest.approx(RATE_BRACKET[0])
@@ -0,0 +1,62 @@
+import json
+import pickle
+import time
+
+import pytest
+
+from jobs import JobManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = JobManager(max_workers = 1, job_dir = str(tmp_path / 'jobs'))
+    yield manager
+    manager.shutdown()
+
+
+def test_job_result(manager):
+    job_id = manager.submit([(max, (1, 2)), (min, (1, 2))])
+    assert manager.wait(job_id, timeout = 30) == [2, 1]
+
+
+@pytest.mark.parametrize('job_id', ['../x', None, 'A' * 32, '0' * 31, {'id': 1}])
+def test_only_job_ids_are_accepted(manager, tmp_path, job_id):
+    assert manager.status(job_id)['state'] == 'unknown'
+    with pytest.raises(RuntimeError):
+        manager.result(job_id)
+
+
+def test_ids_outside_the_job_dir_are_never_read(manager, tmp_path):
+    # a finished job planted outside job_dir, reached by an absolute path
+    planted = tmp_path / 'planted'
+    planted.with_suffix('.json').write_text(json.dumps({'state': 'done', 'done': 1, 'total': 1, 'error': None}))
+    planted.with_suffix('.pkl').write_bytes(pickle.dumps('unpickled'))
+    assert manager.status(str(planted))['state'] == 'unknown'
+    with pytest.raises(RuntimeError):
+        manager.result(str(planted))
+
+
+def pool_free_after(manager, seconds = 10):
+    """
+    How long until a new job gets through the pool, ie until the cancelled job's tasks are out of the way.
+    """
+    started = time.time()
+    manager.wait(manager.submit([(max, (1, 2))]), timeout = seconds)
+    return time.time() - started
+
+
+def test_cancel_drops_the_tasks_that_have_not_started(manager):
+    job_id = manager.submit([(time.sleep, (0.2,))] * 20)
+    assert manager.cancel(job_id)
+    # at most the task that was already running finishes, not all 20 (4 s)
+    assert pool_free_after(manager) < 2
+    assert manager.status(job_id)['state'] == 'cancelled'
+    assert not manager.cancel(job_id)
+
+
+def test_cancel_from_another_process(manager):
+    # the job's tasks check its status before they start, whichever process cancelled it
+    job_id = manager.submit([(time.sleep, (0.2,))] * 20)
+    assert JobManager(max_workers = 1, job_dir = manager.job_dir).cancel(job_id)
+    assert pool_free_after(manager) < 2
+    assert manager.status(job_id)['state'] == 'cancelled'
@@ -0,0 +1,273 @@
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import simulation
+from simulation import (
+    PARAM_NAMES, cpd_interest_batch, cpd_interest_loop, cpd_interest_result, cpd_interest_v4_2, cpd_result_cached,
+    cpd_interest_schedule, cpd_interest_timeline, final_amount_batch, lump_sum, recurring_events, schedule_contributions, summary_batch,
+    timeline_segment_amounts,
+)
+
+### (p, r, t, con, type_con, start_con, stop_con, n)
+ENGINE_CASES = [
+    # Mary and John from the README
+    (0, 0.1, 65, 2_000, 1, 19, 25, 1),
+    (0, 0.1, 65, 2_000, 1, 26, 65, 1),
+    (10_000, 0.0375, 30, 500, 3, 1, 360, 12),
+    (1_000, 0.05, 10, 100, 7, 3, 3_650, 365),
+    # no periods
+    (1_000, 0.1, 0, 100, 1, 1, 10, 12),
+    # stop_con past the horizon
+    (500, 0.07, 5, 200, 1, 1, 1_000, 12),
+    # type_con longer than the horizon: no contribution is ever made
+    (500, 0.07, 2, 200, 50, 1, 24, 12),
+    # no interest
+    (1_000, 0, 20, 100, 1, 1, 240, 12),
+    # negative rate
+    (5_000, -0.02, 15, 50, 2, 5, 100, 4),
+]
+
+
+def loop_frame(*params):
+    # the loop engine prints its totals
+    with contextlib.redirect_stdout(io.StringIO()):
+        return cpd_interest_loop(*params)
+
+
+@pytest.mark.parametrize('params', ENGINE_CASES)
+def test_numpy_engine_matches_loop(params):
+    expected = loop_frame(*params)
+    actual = cpd_interest_v4_2(*params, engine = 'numpy')
+    # both engines round to cents, the last cent can differ by float rounding. With no periods the loop's empty
+    # columns are object dtype
+    pd.testing.assert_frame_equal(actual, expected, check_dtype = len(expected) > 0, atol = 0.01, rtol = 0)
+
+
+@pytest.mark.parametrize('params', ENGINE_CASES)
+def test_default_engine_is_numpy(params):
+    pd.testing.assert_frame_equal(cpd_interest_v4_2(*params), cpd_interest_v4_2(*params, engine = 'numpy'))
+
+
+
+### ENGINE_CASES as one batch: horizons from 0 to 3_650 periods
+BATCH_CASES = pd.DataFrame(ENGINE_CASES, columns = PARAM_NAMES)
+
+
+@pytest.mark.parametrize('chunk_size', [None, 1, 4])
+def test_batch_scenarios_match_loop(chunk_size):
+    batch = cpd_interest_batch(BATCH_CASES, chunk_size = chunk_size)
+    for k, params in enumerate(ENGINE_CASES):
+        expected = loop_frame(*params)
+        # the batch computes in float, the loop keeps int columns int (and object when empty)
+        pd.testing.assert_frame_equal(batch.to_frame(k), expected, check_dtype = False, atol = 0.01, rtol = 0)
+
+
+def test_batch_pads_short_scenarios_with_nan():
+    batch = cpd_interest_batch(BATCH_CASES)
+    periods = [t * n for _, _, t, _, _, _, _, n in ENGINE_CASES]
+    assert batch.amount.shape == (len(ENGINE_CASES), max(periods))
+    for k, count in enumerate(periods):
+        assert not np.isnan(batch.amount[k, :count]).any()
+        assert np.isnan(batch.amount[k, count:]).all()
+    assert len(batch.long_frame()) == sum(periods)
+
+
+
+### where the closed form of final_amount_batch needs care
+CLOSED_FORM_CASES = pd.DataFrame([
+    # g == 0 and g < 0
+    (1_000, -12, 10, 100, 1, 1, 120, 12),
+    (1_000, -3, 5, 100, 2, 1, 60, 1),
+    # rates close to 0
+    (1_000, 1e-12, 30, 100, 1, 1, 360, 12),
+    (1_000, -1e-12, 30, 100, 3, 2, 360, 12),
+    # overflows: inf like the per-period engines, and p = 0 (0 * inf) going through the fallback
+    (1_000, 1.0, 2_000, 100, 1, 1, 2_000, 1),
+    (0, 1.0, 2_000, 100, 1, 1, 2_000, 1),
+    # withdrawals bigger than the growth: -inf
+    (1, 1.0, 2_000, -100, 1, 1, 2_000, 1),
+], columns = PARAM_NAMES)
+
+
+@pytest.mark.parametrize('params', [BATCH_CASES, CLOSED_FORM_CASES], ids = ['engine_cases', 'closed_form_cases'])
+def test_summary_batch_matches_batch_engine(params):
+    expected = cpd_interest_batch(params).summary()
+    actual = summary_batch(params)
+    pd.testing.assert_frame_equal(actual, expected, rtol = 1e-9)
+
+
+def test_final_amount_batch_leaves_overflow_as_inf(monkeypatch):
+    t = np.arange(1, 1_500)
+    params = {'p': 1_000, 'r': 1.0, 't': t, 'con': 100, 'type_con': 1, 'start_con': 1, 'stop_con': 1e9, 'n': 1}
+    expected = cpd_interest_batch(params).final_amount
+    # nothing here needs the per-period fallback
+    monkeypatch.setattr(simulation, 'cpd_interest_batch', None)
+    actual = final_amount_batch(params)
+    np.testing.assert_array_equal(np.isinf(actual), np.isinf(expected))
+    assert np.isinf(actual).any()
+    finite = np.isfinite(expected)
+    np.testing.assert_allclose(actual[finite], expected[finite], rtol = 1e-9)
+
+
+
+def test_long_growth_tables_are_not_cached(monkeypatch):
+    monkeypatch.setattr(simulation, 'GROWTH_TABLE_MAX_PERIODS', 100)
+    simulation.growth_tables.clear()
+    g = 1.0001234
+    growth, discount = simulation.growth_table(g, 101)
+    np.testing.assert_allclose(growth, g ** np.arange(1, 102))
+    assert simulation.growth_tables.get(g) is None
+    simulation.growth_table(g, 100)
+    assert len(simulation.growth_tables.get(g)[0]) == 100
+    # a longer request than the limit leaves the cached table as it was
+    simulation.growth_table(g, 500)
+    assert len(simulation.growth_tables.get(g)[0]) == 100
+    simulation.growth_tables.clear()
+
+
+### (t, stop_con) in the order they're asked for: every run after the first resumes the checkpoint of the one before
+RESUME_SEQUENCES = [
+    # extend t, then shrink it
+    [(10, 120), (20, 120), (5, 120), (30, 120)],
+    # raise stop_con, then lower it
+    [(10, 24), (10, 60), (10, 12), (10, 0), (10, 500)],
+    # both at once, and stop_con past the horizon
+    [(5, 1_000), (40, 30), (2, 30), (40, 1_000), (0, 5), (15, 100)],
+]
+
+
+@pytest.fixture
+def empty_caches():
+    simulation.simulation_cache.clear()
+    simulation.checkpoint_cache.clear()
+    yield
+    simulation.simulation_cache.clear()
+    simulation.checkpoint_cache.clear()
+
+
+@pytest.mark.parametrize('sequence', RESUME_SEQUENCES)
+@pytest.mark.parametrize('p, r, con, type_con, start_con, n', [
+    (1_000, 0.07, 100, 1, 1, 12),
+    (0, 0.05, 250.5, 3, 7, 12),
+    (5_000, -0.01, 20, 2, 1, 4),
+    (100, 0, 10, 5, 3, 1),
+])
+def test_resumed_runs_match_fresh_ones(empty_caches, monkeypatch, sequence, p, r, con, type_con, start_con, n):
+    resumes = []
+    resume_result = simulation.resume_result
+    monkeypatch.setattr(simulation, 'resume_result', lambda *args: resumes.append(1) or resume_result(*args))
+    for t, stop_con in sequence:
+        # only the checkpoint is kept between runs, so every step resumes the previous one instead of a cache hit
+        simulation.simulation_cache.clear()
+        resumed = cpd_result_cached(p, r, t, con, type_con, start_con, stop_con, n)
+        fresh = cpd_interest_result(p, r, t, con, type_con, start_con, stop_con, n)
+        assert resumed.amount.dtype == fresh.amount.dtype
+        assert resumed.contribution.dtype == fresh.contribution.dtype
+        np.testing.assert_array_equal(resumed.contribution, fresh.contribution)
+        np.testing.assert_allclose(resumed.amount, fresh.amount, rtol = 1e-12)
+        pd.testing.assert_frame_equal(resumed.to_frame(), fresh.to_frame(), atol = 0.01, rtol = 0)
+    assert len(resumes) == len(sequence) - 1
+
+
+
+def schedule_loop(p, r, t, n, recurring, lumps):
+    """
+    Plain per-period loop for a schedule. recurring: (amount, every, start, stop, raise_by, raise_every) tuples,
+    lumps: (period, amount) pairs. return: (contributions, amounts)
+    """
+    contributions, amounts = [], []
+    amount = p
+    for period in range(1, int(t * n) + 1):
+        contribution = 0.0
+        for con, every, start, stop, raise_by, raise_every in recurring:
+            if period % every == 0 and start <= period <= stop:
+                raises = (period - start) // raise_every if raise_every else 0
+                contribution += con * (1 + raise_by) ** raises
+        for lump_period, lump in lumps:
+            if lump_period == period:
+                contribution += lump
+        amount = (amount + contribution) * (1 + r / n)
+        contributions.append(contribution)
+        amounts.append(amount)
+    return np.array(contributions), np.array(amounts)
+
+
+### (p, r, t, n, recurring, lumps), see schedule_loop
+SCHEDULE_CASES = [
+    # monthly savings with a 3% raise every year, a lump sum and a withdrawal
+    (1_000, 0.06, 10, 12, [(200, 1, 1, 120, 0.03, 12)], [(24, 5_000), (100, -8_000)]),
+    # quarterly savings starting late, raised every 2 years, on top of yearly ones that stop early
+    (0, 0.04, 20, 12, [(500, 3, 7, 240, 0.1, 24), (1_000, 12, 1, 60, 0, None)], [(60, 2_000)]),
+    # events outside the horizon (before period 1, after the last one) and a recurring stop past it
+    (5_000, 0.05, 5, 4, [(100, 2, 1, 1_000, 0.02, 4)], [(0, 1e6), (-3, 1e6), (21, 1e6), (20, -1_000)]),
+    # two events on the same period, and no interest
+    (100, 0, 3, 12, [], [(12, 50), (12, 25), (36, -100)]),
+]
+
+
+def schedule_events(t, n, recurring, lumps):
+    events = [recurring_events(con, every, start, stop, int(t * n), raise_by, raise_every)
+              for con, every, start, stop, raise_by, raise_every in recurring]
+    return events + [lump_sum(period, amount) for period, amount in lumps]
+
+
+@pytest.mark.parametrize('p, r, t, n, recurring, lumps', SCHEDULE_CASES)
+def test_schedule_matches_loop(p, r, t, n, recurring, lumps):
+    contributions, amounts = schedule_loop(p, r, t, n, recurring, lumps)
+    events = schedule_events(t, n, recurring, lumps)
+    np.testing.assert_allclose(schedule_contributions(events, int(t * n)), contributions, rtol = 1e-12)
+    result = cpd_interest_schedule(p, r, t, n, events)
+    np.testing.assert_allclose(result.contribution, contributions, rtol = 1e-12)
+    np.testing.assert_allclose(result.amount, amounts, rtol = 1e-9)
+
+
+def test_schedule_events_in_any_order():
+    events = schedule_events(*SCHEDULE_CASES[0][2:])
+    np.testing.assert_array_equal(schedule_contributions(events[::-1], 120), schedule_contributions(events, 120))
+
+
+
+def timeline_loop(p, segments, t, n, con, type_con, start_con, stop_con, lumps):
+    """
+    Plain per-period loop for a rate timeline: each period uses the rate of the last segment started by then.
+    """
+    amounts = []
+    amount = p
+    for period in range(1, int(t * n) + 1):
+        r = [rate for start, rate in segments if start <= period][-1]
+        contribution = con if period % type_con == 0 and start_con <= period <= stop_con else 0
+        contribution += sum(lump for lump_period, lump in lumps if lump_period == period)
+        amount = (amount + contribution) * (1 + r / n)
+        amounts.append(amount)
+    return np.array(amounts)
+
+
+### (p, segments, t, n, con, type_con, start_con, stop_con, lumps)
+TIMELINE_CASES = [
+    # accumulate 30 years, then draw down at a lower rate
+    (10_000, [(1, 0.07), (361, 0.03)], 40, 12, 500, 1, 1, 360, [(400, -50_000), (450, -50_000)]),
+    # a crash year in the middle, quarterly contributions starting late
+    (0, [(1, 0.05), (121, -0.3), (133, 0.08)], 20, 12, 1_000, 3, 13, 1_000, []),
+    # segments starting past the horizon are ignored, and so is a lump sum after it
+    (1_000, [(1, 0.04), (10, 0.06), (25, 0.5), (400, 1.0)], 2, 12, 100, 1, 1, 24, [(30, 1e6)]),
+    # a single segment, g <= 0 included
+    (1_000, [(1, -12)], 1, 12, 100, 2, 1, 12, [(5, 10)]),
+    (1_000, [(1, 0.1), (3, 0)], 5, 1, 0, 1, 1, 5, [(1, 100), (5, 100)]),
+]
+
+
+@pytest.mark.parametrize('p, segments, t, n, con, type_con, start_con, stop_con, lumps', TIMELINE_CASES)
+def test_timeline_matches_loop(p, segments, t, n, con, type_con, start_con, stop_con, lumps):
+    expected = timeline_loop(p, segments, t, n, con, type_con, start_con, stop_con, lumps)
+    events = [lump_sum(period, amount) for period, amount in lumps]
+    result = cpd_interest_timeline(p, segments, t, n, con, type_con, start_con, stop_con, events)
+    np.testing.assert_allclose(result.amount, expected, rtol = 1e-9, atol = 1e-6)
+
+    # last period of every segment that starts within the horizon
+    segment_ends = [start - 1 for start, _ in segments[1:] if start <= t * n] + [int(t * n)]
+    amounts = timeline_segment_amounts(p, segments, t, n, con, type_con, start_con, stop_con, events)
+    np.testing.assert_allclose(amounts, expected[np.array(segment_ends) - 1], rtol = 1e-9, atol = 1e-6)